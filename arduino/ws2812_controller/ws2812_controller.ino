@@ -20,6 +20,13 @@
 #define BUFFER_LEN 1024
 // Toggles FPS output (1 = print FPS over serial, 0 = disable output)
 #define PRINT_FPS 1
+// Packet format version. Must match ESP8266_PROTOCOL in config.py
+// Version 1 supports at most 256 LEDs. See protocol.py for details.
+#define PROTOCOL_VERSION 1
+// Version 2 packet types and flags
+#define PACKET_DELTA 0
+#define PACKET_FRAME 1
+#define PACKET_END_OF_FRAME 0x80
 
 //NeoPixelBus settings
 const uint8_t PixelPin = 3;  // make sure to set this to the correct pin, ignored for Esp8266(set to 3 by default for DMA)
@@ -28,9 +35,7 @@ const uint8_t PixelPin = 3;  // make sure to set this to the correct pin, ignore
 const char* ssid     = "YOUR_WIFI_SSID";
 const char* password = "YOUR_WIFI_PASSWORD";
 unsigned int localPort = 7777;
-char packetBuffer[BUFFER_LEN];
-
-uint8_t N = 0;
+uint8_t packetBuffer[BUFFER_LEN];
 
 WiFiUDP port;
 // Network information
@@ -70,23 +75,66 @@ void setup() {
     uint32_t secondTimer = 0;
 #endif
 
+// Sets a pixel from the r, g, b bytes at data, ignoring pixels off the strip
+void setPixel(uint16_t n, const uint8_t* data) {
+    if (n < NUM_LEDS) {
+        RgbColor pixel(data[0], data[1], data[2]);//color
+        ledstrip.SetPixelColor(n, pixel);//n is the pixel number
+    }
+}
+
+#if PROTOCOL_VERSION == 1
+// Decodes |i|r|g|b| records. The strip is updated after every packet.
+bool decodePacket(int len) {
+    for(int i = 0; i + 3 < len; i+=4) {
+        setPixel(packetBuffer[i], &packetBuffer[i+1]);
+    }
+    return true;
+}
+#else
+// Decodes a |version|flags| packet. Returns true on the last packet of a frame.
+bool decodePacket(int len) {
+    if (len < 2 || packetBuffer[0] != PROTOCOL_VERSION) {
+        return false;
+    }
+    uint8_t flags = packetBuffer[1];
+    int i = 2;
+    if ((flags & ~PACKET_END_OF_FRAME) == PACKET_FRAME) {
+        // |offset (16-bit)|r|g|b|r|g|b|...
+        if (len >= 4) {
+            uint16_t n = (packetBuffer[2] << 8) | packetBuffer[3];
+            for(i = 4; i + 2 < len; i+=3) {
+                setPixel(n++, &packetBuffer[i]);
+            }
+        }
+    } else {
+        // |offset (16-bit)|count (8-bit)|r|g|b|...|offset|count|...
+        while (i + 3 <= len) {
+            uint16_t n = (packetBuffer[i] << 8) | packetBuffer[i+1];
+            uint8_t count = packetBuffer[i+2];
+            i += 3;
+            for(uint8_t k = 0; k < count && i + 2 < len; k++, i+=3) {
+                setPixel(n++, &packetBuffer[i]);
+            }
+        }
+    }
+    return flags & PACKET_END_OF_FRAME;
+}
+#endif
+
 void loop() {
     // Read data over socket
     int packetSize = port.parsePacket();
     // If packets have been received, interpret the command
     if (packetSize) {
         int len = port.read(packetBuffer, BUFFER_LEN);
-        for(int i = 0; i < len; i+=4) {
-            packetBuffer[len] = 0;
-            N = packetBuffer[i];
-            RgbColor pixel((uint8_t)packetBuffer[i+1], (uint8_t)packetBuffer[i+2], (uint8_t)packetBuffer[i+3]);//color
-            ledstrip.SetPixelColor(N, pixel);//N is the pixel number
-        } 
-        ledstrip.Show();
-        #if PRINT_FPS
-            fpsCounter++;
-            Serial.print("/");//Monitors connection(shows jumps/jitters in packets)
-        #endif
+        if (decodePacket(len)) {
+            ledstrip.Show();
+            #if PRINT_FPS
+                fpsCounter++;
+                Serial.print("/");//Monitors connection(shows jumps/jitters in packets)
+            #endif
+        }
     }
     #if PRINT_FPS
         if (millis() - secondTimer >= 1000U) {
@@ -0,0 +1,188 @@
+"""Benchmarks every processing stage across a range of settings
+
+Each combination of strip length, number of FFT bins, frame rate and rolling
+history length is benchmarked separately. For every combination, the audio
+analysis (FFT and mel filterbank), each visualization effect and each LED
+backend is timed in isolation. The LED backends write to stub devices, so no
+hardware is needed. Audio is generated by the replay module.
+
+Results are printed and written to a JSON file, which can be compared across
+releases to find performance regressions:
+
+    python benchmark.py --pixels 60 300 1500 --output benchmark.json
+"""
+from __future__ import print_function
+from __future__ import division
+import argparse
+import itertools
+import json
+import platform
+import time
+import timeit
+import numpy as np
+import config
+import fake_blinkstick
+import fake_neopixel
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    from importlib import reload
+except ImportError:
+    pass
+
+
+class StubSocket:
+    """UDP socket that discards packets instead of sending them"""
+    family = None
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+
+    def sendto(self, data, address):
+        self.packets += 1
+        self.bytes += len(data)
+
+
+def load_modules():
+    """Reloads the modules that size their state from config at import"""
+    device, esp8266_protocol = config.DEVICE, config.ESP8266_PROTOCOL
+    config.DEVICE = 'esp8266'
+    # Protocol version 1 is limited to 256 pixels
+    config.ESP8266_PROTOCOL = 2
+    import dsp
+    import effects
+    import led
+    import visualization
+    config.BLINKSTICK_LEDS_PER_CHANNEL = fake_blinkstick.MAX_LEDS_PER_REPORT
+    for module in (dsp, effects, led, visualization):
+        reload(module)
+    config.DEVICE, config.ESP8266_PROTOCOL = device, esp8266_protocol
+    led._sock = StubSocket()
+    led.strip = fake_neopixel.Adafruit_NeoPixel(config.N_PIXELS, 18)
+    led.stick = fake_blinkstick.BlinkStick(channels=led.BLINKSTICK_CHANNELS)
+    return visualization, effects, led
+
+
+def measure(function, args, n_frames):
+    """Returns per-frame durations in seconds and peak allocated bytes"""
+    durations = np.zeros(n_frames)
+    for i in range(n_frames):
+        start = timeit.default_timer()
+        function(*args(i))
+        durations[i] = timeit.default_timer() - start
+    peak = None
+    if tracemalloc is not None:
+        # Allocations are measured separately because tracing is slow
+        tracemalloc.start()
+        peak = 0
+        for i in range(min(n_frames, 20)):
+            a = args(i)
+            base = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            function(*a)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+    return durations, peak
+
+
+def summarize(durations, peak):
+    us = 1e6 * durations
+    return {
+        'mean_us': float(np.mean(us)),
+        'p50_us': float(np.percentile(us, 50)),
+        'p90_us': float(np.percentile(us, 90)),
+        'p99_us': float(np.percentile(us, 99)),
+        'max_us': float(np.max(us)),
+        'peak_alloc_bytes': peak,
+    }
+
+
+def benchmark_config(n_frames):
+    """Benchmarks every stage using the current config settings"""
+    import replay
+    visualization, effects, led = load_modules()
+    block = visualization.samples_per_frame
+    audio = replay.synthetic_signal('noise', duration=(n_frames + 1) * block /
+                                    float(config.MIC_RATE))
+    blocks = [audio[i * block:(i + 1) * block] for i in range(n_frames)]
+    results = {}
+    # Audio analysis
+    durations, peak = measure(visualization.analyze,
+                              lambda i: (blocks[i],), n_frames)
+    results['analysis'] = summarize(durations, peak)
+    # analyze returns the smoothing filter's buffer, which is reused
+    mels = [np.copy(visualization.analyze(b)) for b in blocks]
+    # Visualization effects, each timed with its own fresh state
+    out = np.zeros((3, config.N_PIXELS))
+    frames = None
+    for name, effect_class in effects.EFFECTS.items():
+        effect = effect_class()
+        durations, peak = measure(effect.render, lambda i: (mels[i], out),
+                                  n_frames)
+        results['effect_' + name] = summarize(durations, peak)
+        frames = [np.copy(effect.render(mel, out)) for mel in mels]
+    # LED backends
+    backends = [(led._update_esp8266, False),
+                (led._update_pi, True)]
+    if config.N_PIXELS <= (led.BLINKSTICK_CHANNELS *
+                           config.BLINKSTICK_LEDS_PER_CHANNEL):
+        backends.append((led._update_blinkstick, True))
+    for update, gamma in backends:
+        config.SOFTWARE_GAMMA_CORRECTION = gamma
+
+        def args(i):
+            led.pixels = frames[i]
+            return ()
+        durations, peak = measure(update, args, n_frames)
+        results[update.__name__] = summarize(durations, peak)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pixels', type=int, nargs='+',
+                        default=[60, 150, 300, 600, 1500])
+    parser.add_argument('--bins', type=int, nargs='+', default=[24, 64])
+    parser.add_argument('--fps', type=int, nargs='+', default=[30, 60])
+    parser.add_argument('--history', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--frames', type=int, default=200,
+                        help='number of frames to time for each stage')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='path of the JSON results file')
+    args = parser.parse_args()
+    config.USE_GUI = False
+    config.DISPLAY_FPS = False
+    runs = []
+    for n_pixels, n_bins, fps, history in itertools.product(
+            args.pixels, args.bins, args.fps, args.history):
+        config.N_PIXELS = n_pixels
+        config.N_FFT_BINS = n_bins
+        config.FPS = fps
+        config.N_ROLLING_HISTORY = history
+        settings = {'N_PIXELS': n_pixels, 'N_FFT_BINS': n_bins, 'FPS': fps,
+                    'N_ROLLING_HISTORY': history}
+        results = benchmark_config(args.frames)
+        runs.append({'config': settings, 'stages': results})
+        print(' '.join('{}={}'.format(k, v) for k, v in sorted(settings.items())))
+        for stage, r in sorted(results.items()):
+            print('    {:<22} p50 {:>8.1f} us  p99 {:>8.1f} us  peak {} B'.format(
+                stage, r['p50_us'], r['p99_us'], r['peak_alloc_bytes']))
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'frames': args.frames,
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
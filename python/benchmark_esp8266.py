@@ -0,0 +1,146 @@
+"""Compares the previous and the vectorized ESP8266 packet encoders
+
+The encoders send their packets to UDP receivers running on localhost. The
+previous encoder and the vectorized encoder for protocol version 1 must send
+identical packets. Protocol version 2 packets are decoded by the Python
+stand-in for the firmware, which must end up showing the last frame. Run this
+file directly to print the mean time taken to encode and send one frame and
+the mean number of bytes sent per frame:
+
+    python benchmark_esp8266.py
+"""
+from __future__ import print_function
+from __future__ import division
+import socket
+import threading
+import time
+import timeit
+import numpy as np
+import config
+config.DEVICE = 'esp8266'
+# Protocol version 1 is limited to 256 pixels, so the strips that led is
+# reloaded with default to version 2
+config.ESP8266_PROTOCOL = 2
+config.SOFTWARE_GAMMA_CORRECTION = False
+import led
+import receiver
+try:
+    from importlib import reload
+except ImportError:
+    pass
+
+
+def legacy_update(p, prev, sock, address):
+    """Packet encoder used before the encoder was vectorized"""
+    MAX_PIXELS_PER_PACKET = 126
+    idx = range(p.shape[1])
+    idx = [i for i in idx if not np.array_equal(p[:, i], prev[:, i])]
+    n_packets = len(idx) // MAX_PIXELS_PER_PACKET + 1
+    idx = np.array_split(idx, n_packets)
+    for packet_indices in idx:
+        m = []
+        for i in packet_indices:
+            m.append(i)
+            m.append(p[0][i])
+            m.append(p[1][i])
+            m.append(p[2][i])
+        sock.sendto(bytes(m), address)
+
+
+class Receiver:
+    """Collects every packet sent to a UDP socket bound to localhost"""
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.packets = []
+        thread = threading.Thread(target=self._receive)
+        thread.daemon = True
+        thread.start()
+
+    def _receive(self):
+        while True:
+            packet = self.sock.recv(65536)
+            self.packets.append(packet)
+
+    def wait(self, count, timeout=1.0):
+        end = time.time() + timeout
+        while len(self.packets) < count and time.time() < end:
+            time.sleep(0.001)
+
+
+def random_frames(n_pixels, n_frames, changed):
+    """Returns frames where a fraction of the pixels change every frame"""
+    frames = [np.random.randint(0, 256, (3, n_pixels))]
+    for _ in range(n_frames - 1):
+        frame = frames[-1].copy()
+        mask = np.random.rand(n_pixels) < changed
+        frame[:, mask] = np.random.randint(0, 256, (3, mask.sum()))
+        frames.append(frame)
+    return frames
+
+
+def benchmark(n_pixels, changed, n_frames=200):
+    results = {}
+    config.N_PIXELS = n_pixels
+    # The LED module sizes its frame buffers from config at import
+    reload(led)
+    frames = random_frames(n_pixels, n_frames, changed)
+    if n_pixels <= 256:
+        # Previous encoder
+        legacy_receiver = Receiver()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        prev = np.tile(253, (3, n_pixels))
+        start = timeit.default_timer()
+        for frame in frames:
+            legacy_update(frame, prev, sock, legacy_receiver.address)
+            prev = frame
+        results['legacy'] = (timeit.default_timer() - start) / n_frames
+        legacy_receiver.wait(n_frames)
+        time.sleep(0.05)
+        # Vectorized encoder, protocol version 1
+        new_receiver = Receiver()
+        led.devices = [led.ESP8266(*new_receiver.address, protocol=1)]
+        start = timeit.default_timer()
+        for frame in frames:
+            led.pixels = frame
+            led._update_esp8266()
+        results['v1'] = (timeit.default_timer() - start) / n_frames
+        new_receiver.wait(len(legacy_receiver.packets))
+        assert new_receiver.packets == legacy_receiver.packets, \
+            'Encoders sent different packets'
+        results['v1_bytes'] = sum(map(len, new_receiver.packets)) / n_frames
+    # Vectorized encoder, protocol version 2
+    esp8266 = receiver.Receiver(n_pixels, version=2).start()
+    led.devices = [led.ESP8266(*esp8266.address, protocol=2)]
+    start = timeit.default_timer()
+    for frame in frames:
+        led.pixels = frame
+        led._update_esp8266()
+    results['v2'] = (timeit.default_timer() - start) / n_frames
+    assert esp8266.wait(n_frames), 'Frames were not received'
+    assert np.array_equal(esp8266.shown, frames[-1]), 'Wrong frame shown'
+    results['v2_bytes'] = esp8266.bytes / n_frames
+    return results
+
+
+if __name__ == '__main__':
+    columns = ['legacy', 'v1', 'v2', 'v1_bytes', 'v2_bytes']
+    print('{:>7} {:>8} {:>12} {:>12} {:>12} {:>10} {:>10}'.format(
+        'pixels', 'changed', 'legacy (us)', 'v1 (us)', 'v2 (us)',
+        'v1 bytes', 'v2 bytes'))
+    for n_pixels in [60, 144, 256, 600, 1500]:
+        for changed in [0.1, 0.5, 1.0]:
+            results = benchmark(n_pixels, changed)
+            values = []
+            for column in columns:
+                value = results.get(column)
+                if value is None:
+                    values.append('-')
+                elif column.endswith('bytes'):
+                    values.append('{:.0f}'.format(value))
+                else:
+                    values.append('{:.1f}'.format(1e6 * value))
+            print('{:>7} {:>8.0%} {:>12} {:>12} {:>12} {:>10} {:>10}'.format(
+                n_pixels, changed, *values))
@@ -0,0 +1,85 @@
+"""On-disk cache of precomputed arrays
+
+Tables that are slow to compute at startup, such as the mel filterbank
+matrix, are saved as .npy files in config.CACHE_DIR. Each file is named
+after the settings it was computed from, so changing the settings computes
+and saves a new table while the old one stays valid. Files are written to a
+temporary name and then renamed, so a power cut while saving can never
+leave a partial table behind. Only the MAX_FILES most recently used tables
+are kept, so settings that change all the time, such as the frequency range
+set with the GUI slider, can not fill up the disk.
+
+The cache is optional. If config.CACHE_DIR is None, or the directory can
+not be written, tables are computed every time.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import re
+import numpy as np
+import config
+
+VERSION = 1
+"""Increment when a cached table is computed differently"""
+
+MAX_FILES = 16
+"""Number of tables kept in the cache directory"""
+
+
+def path(name, key):
+    """Returns the path of the cache file for a table and its settings"""
+    text = '_'.join(str(k) for k in key)
+    text = re.sub(r'[^A-Za-z0-9.\-]+', '-', text)
+    filename = '{}_v{}_{}.npy'.format(name, VERSION, text)
+    return os.path.join(config.CACHE_DIR, filename)
+
+
+def cached(name, key, compute):
+    """Returns a table, loading it from the cache if it has been saved
+
+    Parameters
+    ----------
+    name : str
+        Name of the table, such as 'melmat'.
+    key : tuple
+        Settings the table is computed from.
+    compute : callable
+        Function that computes the table as a numpy array. It is only
+        called if the table is not in the cache.
+    """
+    if config.CACHE_DIR is None:
+        return compute()
+    filename = path(name, key)
+    try:
+        array = np.load(filename)
+        # Mark the table as recently used
+        os.utime(filename, None)
+        return array
+    except (IOError, OSError, ValueError, EOFError):
+        pass
+    array = compute()
+    try:
+        if not os.path.isdir(config.CACHE_DIR):
+            os.makedirs(config.CACHE_DIR)
+        temporary = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.save(f, array)
+        os.rename(temporary, filename)
+        _evict()
+    except (IOError, OSError):
+        # For example a read-only file system
+        pass
+    return array
+
+
+def _evict():
+    """Removes the least recently used tables beyond MAX_FILES"""
+    paths = [os.path.join(config.CACHE_DIR, f)
+             for f in os.listdir(config.CACHE_DIR) if f.endswith('.npy')]
+    paths.sort(key=os.path.getmtime)
+    for filename in paths[:-MAX_FILES]:
+        try:
+            os.remove(filename)
+        except OSError:
+            # Removed by another process in the meantime
+            pass
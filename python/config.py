@@ -22,6 +22,35 @@ if DEVICE == 'esp8266':
     """IP address of the ESP8266. Must match IP in ws2812_controller.ino"""
     UDP_PORT = 7777
     """Port number used for socket communication between Python and ESP8266"""
+    ESP8266_PROTOCOL = 1
+    """Version of the packet format sent to the ESP8266
+
+    Must match PROTOCOL_VERSION in ws2812_controller.ino. Version 1 is the
+    original format understood by all firmware and supports at most 256 LEDs.
+    Version 2 supports longer strips and uses less bandwidth when most of the
+    pixels change, but the ESP8266 must first be flashed with firmware that
+    has PROTOCOL_VERSION set to 2. See protocol.py for details.
+    """
+    ESP8266_DEVICES = None
+    """ESP8266 controllers that the LED strip is split across
+
+    Set to None to display the whole strip on the single ESP8266 at UDP_IP.
+    Otherwise this is a list of dicts, one per controller, with the keys:
+        'ip': IP address of the ESP8266
+        'port': UDP port of the ESP8266 (optional, defaults to UDP_PORT)
+        'pixels': pixels of the strip shown by the ESP8266 (optional, defaults
+            to the whole strip). Either a slice, such as slice(0, 150), or a
+            list of pixel indices. Use a reversed slice such as
+            slice(None, None, -1) to mirror the strip.
+        'protocol': packet format version of the ESP8266 (optional, defaults
+            to ESP8266_PROTOCOL)
+    Audio is analyzed and rendered once for all of the controllers.
+    For example, to split a 300 pixel strip across two controllers:
+        ESP8266_DEVICES = [
+            {'ip': '192.168.0.150', 'pixels': slice(0, 150)},
+            {'ip': '192.168.0.151', 'pixels': slice(150, 300)},
+        ]
+    """
     SOFTWARE_GAMMA_CORRECTION = False
     """Set to False because the firmware handles gamma correction + dither"""
 
@@ -40,24 +69,143 @@ if DEVICE == 'pi':
     """Set to True because Raspberry Pi doesn't use hardware dithering"""
 
 if DEVICE == 'blinkstick':
+    BLINKSTICK_LEDS_PER_CHANNEL = 64
+    """Maximum number of LEDs sent in a single report to one channel
+
+    Strips longer than this are split into consecutive segments of this many
+    LEDs, and segment i is sent to channel i of the BlinkStick. The BlinkStick
+    Pro supports up to 64 LEDs on each of its 3 channels, so N_PIXELS must be
+    at most 3 times this value.
+    """
     SOFTWARE_GAMMA_CORRECTION = True
     """Set to True because blinkstick doesn't use hardware dithering"""
 
 USE_GUI = True
 """Whether or not to display a PyQtGraph GUI plot of visualization"""
 
+GUI_FPS = 30
+"""Maximum refresh rate of the GUI plots
+
+The GUI is drawn by its own process at this rate, separately from the audio
+loop, and only shows the most recent frame.
+"""
+
 DISPLAY_FPS = True
 """Whether to display the FPS when running (can reduce performance)"""
 
+INSTRUMENTATION = False
+"""Whether to record how long each processing stage takes
+
+When enabled, the duration of every stage of the audio and LED pipeline is
+recorded in a histogram. Instead of the FPS, a summary of the median and 99th
+percentile duration of each stage, the number of dropped frames and the number
+of audio buffer overflows is output every INSTRUMENTATION_INTERVAL seconds.
+"""
+
+INSTRUMENTATION_INTERVAL = 5.0
+"""Number of seconds between instrumentation summaries"""
+
+INSTRUMENTATION_PATH = None
+"""File that instrumentation summaries are appended to as lines of JSON
+
+Summaries are printed if this is None.
+"""
+
+TELEMETRY_PORT = None
+"""Port of the local HTTP endpoint that serves live metrics as JSON
+
+Set to a port number such as 8080 to enable the endpoint, then request
+http://localhost:8080/ to read the frame rate, LED traffic, audio overflows
+and the current effect. Per-stage latencies are included when
+INSTRUMENTATION is True. The endpoint is disabled if this is None.
+"""
+
+TELEMETRY_HOST = '127.0.0.1'
+"""Address the telemetry endpoint listens on. Use '0.0.0.0' for all hosts"""
+
+RECORDING_PATH = None
+"""File that every frame sent to the LED strip is recorded to
+
+Frames are recorded before gamma correction, with the time they were sent.
+Play a recording back on the LED strip with:
+    python recording.py path/to/recording
+which does not record, whatever this is set to. An existing file is
+replaced when the first frame is displayed. Nothing is recorded if this is
+None.
+"""
+
+USE_PIPELINE = False
+"""Whether to run audio capture, rendering and LED output on separate threads
+
+When enabled, audio is captured, rendered and sent to the LED strip by three
+pipeline stages that are connected by small queues. A slow render or LED
+update no longer delays reading the next block of audio. When a stage falls
+behind, the oldest queued item is dropped so that the newest one is used.
+With DISPLAY_FPS the FPS and the time taken by each stage are printed once a
+second, or with INSTRUMENTATION they are part of its summary.
+"""
+
+PIPELINE_QUEUE_SIZE = 2
+"""Maximum number of items waiting between two pipeline stages"""
+
 N_PIXELS = 60
 """Number of pixels in the LED strip (must match ESP8266 firmware)"""
 
 GAMMA_TABLE_PATH = os.path.join(os.path.dirname(__file__), 'gamma_table.npy')
 """Location of the gamma correction table"""
 
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+"""Directory where precomputed tables are cached between runs
+
+The mel filterbank matrix is saved here the first time it is computed for a
+set of settings, and loaded on later runs. Only the most recently used
+tables are kept. Set to None to disable the cache.
+"""
+
+SOFTWARE_DITHERING = False
+"""Whether to dither gamma corrected pixel values over time
+
+Only used when SOFTWARE_GAMMA_CORRECTION is True. Gamma correction maps many
+dim input values to the same output value, for example every input below 12
+to 0. With dithering, each pixel alternates between the two nearest output
+values from frame to frame so that its average brightness follows the gamma
+curve exactly, like the ESP8266 firmware does. This works best at high frame
+rates, and means that the pixels change on every frame.
+"""
+
+DITHERING_GAMMA = 2.0
+"""Exponent of the gamma curve used for dithering
+
+This matches gamma_table.npy, which holds round(255 * (x / 255)**2.0).
+"""
+
 MIC_RATE = 44100
 """Sampling frequency of the microphone in Hz"""
 
+N_CHANNELS = 1
+"""Number of audio channels to record, such as 2 for stereo
+
+Every channel is transformed to the frequency domain in a single batched pass.
+The effects display the mean of the channels' mel spectra, unless a zone in
+ZONES selects a single channel.
+"""
+
+AUDIO_REPLAY_SOURCE = None
+"""Audio to play back instead of recording from the microphone
+
+Set to None to record live audio from the microphone. Otherwise this is either
+the name of a synthetic test signal ('sweep', 'clicks' or 'noise'), the path to
+a 16-bit WAV file that is either mono or has N_CHANNELS channels, or the path to
+a file of raw 16-bit PCM samples with N_CHANNELS interleaved channels. Replayed
+audio must use the MIC_RATE sampling frequency.
+"""
+
+AUDIO_REPLAY_REALTIME = True
+"""Whether replayed audio is paced in real time or played as fast as possible"""
+
+AUDIO_REPLAY_LOOP = True
+"""Whether replayed audio restarts from the beginning when it ends"""
+
 FPS = 60
 """Desired refresh rate of the visualization (frames per second)
 
@@ -83,6 +231,25 @@ MIN_FREQUENCY = 200
 MAX_FREQUENCY = 12000
 """Frequencies above this value will be removed during audio processing"""
 
+ZONES = None
+"""Segments of the LED strip that show different effects
+
+If None, the whole strip shows a single effect. Otherwise a list with a
+dictionary for each zone, containing:
+    'pixels': slice of the strip covered by the zone, such as slice(0, 100)
+    'effect': name of the effect, one of 'scroll', 'energy' or 'spectrum'
+    'min_frequency', 'max_frequency': frequency range in Hz that the zone
+        reacts to (optional, defaults to MIN_FREQUENCY and MAX_FREQUENCY).
+        The range must contain at least 3 of the N_FFT_BINS mel bands.
+    'channel': audio channel that the zone reacts to, from 0 to
+        N_CHANNELS - 1 (optional, defaults to the mean of all channels)
+The audio is analyzed once per frame for all of the zones. For example:
+    ZONES = [
+        {'pixels': slice(0, 30), 'effect': 'energy', 'max_frequency': 800},
+        {'pixels': slice(30, 60), 'effect': 'spectrum'},
+    ]
+"""
+
 N_FFT_BINS = 24
 """Number of frequency bins to use when transforming audio to frequency domain
 
@@ -101,5 +268,50 @@ There is no point using more bins than there are pixels on the LED strip.
 N_ROLLING_HISTORY = 2
 """Number of past audio frames to include in the rolling window"""
 
+FFT_WINDOW_LENGTH = None
+"""Number of audio samples analyzed by each FFT
+
+Longer windows improve the frequency resolution of low frequencies, but
+respond more slowly to changes in the audio. When set, the window length is
+independent of the frame rate, so long windows can be used at high frame rates.
+Set to None to use N_ROLLING_HISTORY frames worth of audio samples, which
+ties the window length to FPS.
+"""
+
+FFT_HOP_LENGTH = None
+"""Number of new audio samples read between frames
+
+Set to None to read MIC_RATE / FPS samples, which produces FPS frames per
+second.
+"""
+
+FFT_SIZE = None
+"""Number of samples in each FFT, including zero padding
+
+Must be at least FFT_WINDOW_LENGTH. Set to None to use the next power of two.
+"""
+
 MIN_VOLUME_THRESHOLD = 1e-7
 """No music visualization displayed if recorded audio volume below threshold"""
+
+ONSET_DETECTION = False
+"""Whether to detect onsets, such as drum hits, that effects can react to
+
+Onsets are detected from sudden increases in energy across the mel bands,
+and show up in the effects sooner than changes in the smoothed spectrum.
+The scroll effect flashes on every onset. Onsets are only detected while
+an effect that reacts to them is shown.
+"""
+
+ONSET_SUBDIVISIONS = 4
+"""Number of hops each audio frame is split into for onset detection
+
+Onsets are detected from a short window over the newest samples of every
+hop, which catches transients near the end of a frame in that same frame.
+Set to 1 to detect onsets from the mel spectrum of each frame instead,
+which is cheaper but can be a frame late.
+"""
+
+ONSET_THRESHOLD = 4.0
+"""Number of standard deviations above its recent mean that the spectral flux
+must rise for an onset to be detected. Lower values detect more onsets."""
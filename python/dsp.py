@@ -1,30 +1,393 @@
 from __future__ import print_function
+import collections
 import numpy as np
+import cache
 import config
 import melbank
 
 
 class ExpFilter:
-    """Simple exponential smoothing filter"""
+    """Simple exponential smoothing filter
+
+    Array values are updated in place using preallocated buffers, so the
+    array returned by ``update`` is the same object on every call.
+    """
     def __init__(self, val=0.0, alpha_decay=0.5, alpha_rise=0.5):
         """Small rise / decay factors = more smoothing"""
         assert 0.0 < alpha_decay < 1.0, 'Invalid decay smoothing factor'
         assert 0.0 < alpha_rise < 1.0, 'Invalid rise smoothing factor'
         self.alpha_decay = alpha_decay
         self.alpha_rise = alpha_rise
+        if isinstance(val, (list, np.ndarray, tuple)):
+            # Copy to a float array that can be updated in place
+            val = np.array(val, dtype=float)
+            self._delta = np.zeros_like(val)
+            self._alpha = np.zeros_like(val)
         self.value = val
 
     def update(self, value):
-        if isinstance(self.value, (list, np.ndarray, tuple)):
-            alpha = value - self.value
-            alpha[alpha > 0.0] = self.alpha_rise
-            alpha[alpha <= 0.0] = self.alpha_decay
+        if isinstance(self.value, np.ndarray):
+            delta, alpha = self._delta, self._alpha
+            # value + alpha * (new - value) is the usual smoothing update
+            np.subtract(value, self.value, out=delta)
+            np.greater(delta, 0.0, out=alpha)
+            alpha *= self.alpha_rise - self.alpha_decay
+            alpha += self.alpha_decay
+            delta *= alpha
+            self.value += delta
         else:
             alpha = self.alpha_rise if value > self.value else self.alpha_decay
-        self.value = alpha * value + (1.0 - alpha) * self.value
+            self.value = alpha * value + (1.0 - alpha) * self.value
+        return self.value
+
+
+class ExpFilterBank:
+    """Several exponential smoothing filters of the same shape
+
+    The values of every filter are stacked into one array, so all of the
+    filters are updated together in a single vectorized pass. Each filter
+    has its own rise and decay smoothing factors.
+
+    Parameters
+    ----------
+    val : array_like
+        Initial values with shape (n_filters, ...). Row i holds the value
+        of filter i.
+    alpha_decay, alpha_rise : sequence of float
+        Decay and rise smoothing factor of each filter.
+    """
+    def __init__(self, val, alpha_decay, alpha_rise):
+        self.value = np.array(val, dtype=float)
+        shape = (len(self.value),) + (1,) * (self.value.ndim - 1)
+        self.alpha_decay = np.reshape(np.array(alpha_decay, dtype=float), shape)
+        self.alpha_rise = np.reshape(np.array(alpha_rise, dtype=float), shape)
+        assert np.all((0.0 < self.alpha_decay) & (self.alpha_decay < 1.0)), \
+            'Invalid decay smoothing factor'
+        assert np.all((0.0 < self.alpha_rise) & (self.alpha_rise < 1.0)), \
+            'Invalid rise smoothing factor'
+        self._alpha_range = self.alpha_rise - self.alpha_decay
+        self.input = np.zeros_like(self.value)
+        """Buffer the input of each filter can be written to before update"""
+        self._delta = np.zeros_like(self.value)
+        self._alpha = np.zeros_like(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def update(self, value=None):
+        """Updates every filter and returns the stacked filter values
+
+        Parameters
+        ----------
+        value : array_like, optional
+            New input of every filter, with the same shape as ``value``.
+            Defaults to the ``input`` buffer.
+        """
+        if value is None:
+            value = self.input
+        delta, alpha = self._delta, self._alpha
+        np.subtract(value, self.value, out=delta)
+        np.greater(delta, 0.0, out=alpha)
+        alpha *= self._alpha_range
+        alpha += self.alpha_decay
+        delta *= alpha
+        self.value += delta
         return self.value
 
 
+class SparseFilterbank:
+    """Filterbank that stores only the nonzero weights of each band
+
+    Each row of a mel matrix is a triangle that spans a handful of FFT bins,
+    so multiplying the full matrix wastes most of its work on zeros. Here the
+    weights of every band are stored back to back, together with the FFT bin
+    they apply to. Applying the filterbank gathers those bins, scales them by
+    their weights and sums each band with a single ``np.add.reduceat`` call.
+    All intermediate buffers are preallocated, so ``apply`` does not allocate
+    unless no output array is given.
+    """
+    def __init__(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        n_bands, n_bins = matrix.shape
+        nonzero = matrix != 0
+        # First and last nonzero bin of each band. reduceat needs at least
+        # one element per band, so empty bands use bin 0
+        empty = ~nonzero.any(axis=1)
+        lo = np.where(empty, 0, nonzero.argmax(axis=1))
+        hi = np.where(empty, 1, n_bins - nonzero[:, ::-1].argmax(axis=1))
+        lengths = hi - lo
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.intp)
+        # Bins of every band back to back: lo, lo + 1, ..., hi - 1
+        index = np.arange(lengths.sum()) - np.repeat(starts - lo, lengths)
+        bands = np.repeat(np.arange(n_bands), lengths)
+        self.n_bands = n_bands
+        self.n_bins = n_bins
+        self.starts = starts
+        self.index = index.astype(np.intp)
+        self.weights = matrix[bands, self.index]
+        self._buffer = np.zeros(len(self.index))
+        self._weights = self.weights
+        self._sums = np.zeros(n_bands)
+
+    def apply(self, spectrum, out=None):
+        """Returns the filterbank output for the given magnitude spectrum
+
+        The spectrum may have leading dimensions, such as one row per audio
+        channel, in which case every row is filtered in the same pass.
+        """
+        shape = spectrum.shape[:-1]
+        if out is None:
+            out = np.zeros(shape + (self.n_bands,))
+        if (self._buffer.dtype != spectrum.dtype or
+                self._buffer.shape[:-1] != shape):
+            # np.take can only gather into a buffer of the same type, and
+            # numpy allocates temporary buffers for operands of mixed types
+            self._buffer = np.zeros(shape + (len(self.index),),
+                                    dtype=spectrum.dtype)
+            self._weights = self.weights.astype(spectrum.dtype)
+            self._sums = np.zeros(shape + (self.n_bands,),
+                                  dtype=spectrum.dtype)
+        # The indices are always valid, and mode='raise' buffers the output
+        np.take(spectrum, self.index, axis=-1, out=self._buffer, mode='clip')
+        np.multiply(self._buffer, self._weights, out=self._buffer)
+        if out.dtype == spectrum.dtype:
+            np.add.reduceat(self._buffer, self.starts, axis=-1, out=out)
+        else:
+            np.add.reduceat(self._buffer, self.starts, axis=-1,
+                            out=self._sums)
+            np.copyto(out, self._sums)
+        return out
+
+
+class RollingWindow:
+    """Ring buffer holding the most recent window of audio samples
+
+    Incoming int16 blocks are normalized into a preallocated float32 buffer.
+    Every sample is written twice, half a buffer apart, so the latest window
+    is always available as a contiguous view without copying.
+
+    Parameters
+    ----------
+    length : int
+        Number of samples in the window.
+    channels : int, optional
+        Number of audio channels. If given, blocks and windows have the
+        shape (channels, samples). Mono blocks are copied to every channel.
+    """
+    def __init__(self, length, channels=None):
+        shape = () if channels is None else (channels,)
+        self.length = length
+        self._buffer = np.zeros(shape + (2 * length,), dtype=np.float32)
+        self._pos = 0
+
+    def push(self, samples):
+        """Adds a block of int16 samples to the window"""
+        samples = samples[..., -self.length:]
+        n, pos, length = samples.shape[-1], self._pos, self.length
+        head = min(n, length - pos)
+        for start, stop, src in ((pos, pos + head, samples[..., :head]),
+                                 (0, n - head, samples[..., head:])):
+            if stop > start:
+                for offset in (0, length):
+                    out = self._buffer[..., offset + start:offset + stop]
+                    np.multiply(src, 1.0 / 2.0**15, dtype=np.float32, out=out)
+        self._pos = (pos + n) % length
+
+    def latest(self):
+        """Returns a view of the window, oldest sample first"""
+        return self._buffer[..., self._pos:self._pos + self.length]
+
+
+class GaussianBlur:
+    """Gaussian blur along one axis of arrays with a fixed shape
+
+    Gives the same result as scipy.ndimage.gaussian_filter1d with the
+    default 'reflect' mode and truncate=4.0. The kernel and the indices of
+    the reflected edges are computed once. Each call gathers the padded
+    input into a preallocated buffer with a single ``np.take``, then
+    correlates every row with the kernel at once, so all of the color
+    channels of a frame are blurred in one call.
+
+    Parameters
+    ----------
+    sigma : float
+        Standard deviation of the Gaussian kernel in samples.
+    shape : tuple of int
+        Shape of the arrays that are blurred.
+    axis : int
+        Axis along which to blur.
+    """
+    def __init__(self, sigma, shape, axis=-1):
+        radius = int(4.0 * sigma + 0.5)
+        x = np.arange(-radius, radius + 1)
+        kernel = np.exp(-0.5 / sigma**2 * x**2)
+        self.kernel = kernel / kernel.sum()
+        self.shape = tuple(shape)
+        self.axis = axis
+        n = self.shape[axis]
+        # Index of the input sample at each padded position, reflecting
+        # about the edges as many times as needed: d c b a | a b c d | d c b a
+        i = np.arange(-radius, n + radius) % (2 * n)
+        self._index = np.where(i >= n, 2 * n - 1 - i, i)
+        padded_shape = list(self.shape)
+        padded_shape[axis] = n + 2 * radius
+        self._padded = np.zeros(padded_shape)
+        padded = np.moveaxis(self._padded, axis, -1)
+        # View of every window of len(kernel) samples along the last axis
+        self._windows = np.lib.stride_tricks.as_strided(
+            padded, shape=padded.shape[:-1] + (n, len(self.kernel)),
+            strides=padded.strides + padded.strides[-1:])
+        self._padded_view = padded
+        self._product = np.zeros(padded.shape[:-1] + (n,))
+        self.output = np.zeros(self.shape)
+        """Output array used when no output array is given"""
+
+    def apply(self, x, out=None):
+        """Blurs x and returns the result
+
+        Parameters
+        ----------
+        x : np.array
+            Input array with the shape given at construction.
+        out : np.array, optional
+            Float array with the same shape that receives the result.
+            Defaults to ``output``, which is overwritten on every call.
+        """
+        if out is None:
+            out = self.output
+        np.take(np.asarray(x, dtype=self._padded.dtype), self._index,
+                axis=self.axis, out=self._padded)
+        result = np.moveaxis(out, self.axis, -1)
+        n = result.shape[-1]
+        if len(self.kernel) <= 5:
+            # Short kernels are faster to apply one shifted copy at a time
+            padded, product = self._padded_view, self._product
+            np.multiply(padded[..., :n], self.kernel[0], out=result)
+            for k in range(1, len(self.kernel)):
+                np.multiply(padded[..., k:k + n], self.kernel[k], out=product)
+                result += product
+        else:
+            np.einsum('...ij,j->...i', self._windows, self.kernel, out=result)
+        return out
+
+
+_blurs = {}
+"""Cached GaussianBlur for each (sigma, shape, axis)"""
+
+
+def gaussian_blur(x, sigma, axis=-1, out=None):
+    """Blurs an array with a cached Gaussian kernel
+
+    Equivalent to scipy.ndimage.gaussian_filter1d(x, sigma, axis), except
+    that the result is written to a buffer that is reused by later calls
+    with the same sigma, shape and axis unless an output array is given.
+    """
+    key = (sigma, np.shape(x), axis)
+    if key not in _blurs:
+        _blurs[key] = GaussianBlur(sigma, np.shape(x), axis)
+    return _blurs[key].apply(x, out)
+
+
+def stft_settings():
+    """Returns the (window_length, hop_length, n_fft) set in config"""
+    hop_length = config.FFT_HOP_LENGTH
+    if hop_length is None:
+        hop_length = int(config.MIC_RATE / config.FPS)
+    window_length = config.FFT_WINDOW_LENGTH
+    if window_length is None:
+        window_length = int(config.MIC_RATE / config.FPS) * config.N_ROLLING_HISTORY
+    n_fft = config.FFT_SIZE
+    if n_fft is None:
+        n_fft = 2**int(np.ceil(np.log2(window_length)))
+    return window_length, hop_length, n_fft
+
+
+_stft_plans = {}
+"""Window and frequency axis for each (window_length, n_fft, rate)"""
+
+try:
+    np.fft.rfft(np.zeros(2), out=np.zeros(2, dtype=complex))
+    _rfft_out = True
+except TypeError:
+    _rfft_out = False
+"""Whether np.fft.rfft can write into an existing array (numpy 2.0+)"""
+
+
+def _stft_plan(window_length, n_fft, rate):
+    key = (window_length, n_fft, rate)
+    if key not in _stft_plans:
+        window = np.hamming(window_length).astype(np.float32)
+        frequencies = np.fft.rfftfreq(n_fft, 1.0 / rate)
+        _stft_plans[key] = window, frequencies
+    return _stft_plans[key]
+
+
+class STFT:
+    """Short-time Fourier transform of the most recent audio samples
+
+    Blocks of hop_length samples are added to a rolling window of
+    window_length samples. The spectrum of the window is computed with a
+    Hamming window and zero padding to n_fft samples. The window and the
+    frequency axis are shared between transforms with the same settings,
+    and the zero padded input is kept in a preallocated buffer.
+
+    Parameters
+    ----------
+    window_length : int
+        Number of samples in the analysis window.
+    hop_length : int
+        Number of new samples added between transforms.
+    n_fft : int, optional
+        Length of the zero padded FFT input. Defaults to the next power of
+        two that is at least window_length.
+    rate : int, optional
+        Sampling rate in Hz. Defaults to config.MIC_RATE.
+    channels : int, optional
+        Number of audio channels. If given, every channel is transformed
+        with a single batched FFT and the spectrum has one row per channel.
+    """
+    def __init__(self, window_length, hop_length, n_fft=None, rate=None,
+                 channels=None):
+        if n_fft is None:
+            n_fft = 2**int(np.ceil(np.log2(window_length)))
+        assert n_fft >= window_length, 'FFT size must be >= window length'
+        rate = config.MIC_RATE if rate is None else rate
+        self.window_length = window_length
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.window, self.frequencies = _stft_plan(window_length, n_fft, rate)
+        shape = () if channels is None else (channels,)
+        self.samples = RollingWindow(window_length, channels)
+        self._padded = np.zeros(shape + (n_fft,), dtype=np.float32)
+        # Buffers for the transform and its magnitude, with the types that
+        # np.fft.rfft returns for this input
+        self._transform = np.fft.rfft(self._padded, axis=-1)
+        self._magnitude = np.abs(self._transform)
+
+    def push(self, samples):
+        """Adds a block of int16 samples to the analysis window"""
+        self.samples.push(samples)
+
+    def latest(self):
+        """Returns the normalized samples in the analysis window"""
+        return self.samples.latest()
+
+    def spectrum(self):
+        """Returns the magnitude spectrum of the analysis window
+
+        The spectrum has n_fft // 2 + 1 bins with the frequencies given
+        by the frequencies attribute. The returned array is overwritten by
+        the next call.
+        """
+        np.multiply(self.samples.latest(), self.window,
+                    out=self._padded[..., :self.window_length])
+        if _rfft_out:
+            np.fft.rfft(self._padded, axis=-1, out=self._transform)
+        else:
+            self._transform = np.fft.rfft(self._padded, axis=-1)
+        return np.abs(self._transform, out=self._magnitude)
+
+
 def rfft(data, window=None):
     window = 1.0 if window is None else window(len(data))
     ys = np.abs(np.fft.rfft(data * window))
@@ -39,15 +402,274 @@ def fft(data, window=None):
     return xs, ys
 
 
+class MelBank:
+    """Mel filterbank for one set of spectrum and frequency range settings
+
+    Bundles the mel matrix, the FFT bin frequencies and the sparse
+    filterbank built from them, so that all of them can be replaced
+    together with a single assignment.
+
+    Parameters
+    ----------
+    n_bands : int
+        Number of mel bands.
+    freq_min, freq_max : float
+        Frequency range of the filterbank in Hz.
+    n_fft : int
+        Length of the FFT input. The spectrum has n_fft // 2 + 1 bins.
+    rate : int
+        Sampling rate in Hz.
+    """
+    def __init__(self, n_bands, freq_min, freq_max, n_fft, rate):
+        self.n_bins = n_fft // 2 + 1
+        """Number of FFT bins in the spectrum"""
+        self.frequencies = np.linspace(0.0, rate / 2.0, self.n_bins)
+        """Frequency of each FFT bin in Hz"""
+        self.matrix = cache.cached(
+            'melmat', (n_bands, freq_min, freq_max, self.n_bins, rate),
+            lambda: melbank.compute_melmat(
+                num_mel_bands=n_bands, freq_min=freq_min, freq_max=freq_max,
+                num_fft_bands=self.n_bins, sample_rate=rate)[0])
+        self.filterbank = SparseFilterbank(self.matrix)
+
+    def apply(self, spectrum, out=None):
+        """Returns the mel spectrum. See SparseFilterbank.apply"""
+        return self.filterbank.apply(spectrum, out)
+
+
+MEL_BANK_CACHE_SIZE = 16
+"""Number of recently used mel filterbanks kept in memory"""
+
+_mel_banks = collections.OrderedDict()
+"""Recently used mel filterbanks, least recently used first"""
+
+
+def get_mel_bank(n_bands, freq_min, freq_max, n_fft, rate):
+    """Returns a cached MelBank, building it if it is not in the cache"""
+    key = (n_bands, freq_min, freq_max, n_fft, rate)
+    try:
+        bank = _mel_banks.pop(key)
+    except KeyError:
+        bank = MelBank(*key)
+    _mel_banks[key] = bank
+    while len(_mel_banks) > MEL_BANK_CACHE_SIZE:
+        _mel_banks.popitem(last=False)
+    return bank
+
+
 def create_mel_bank():
-    global samples, mel_y, mel_x
-    samples = int(config.MIC_RATE * config.N_ROLLING_HISTORY / (2.0 * config.FPS))
-    mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=config.N_FFT_BINS,
-                                               freq_min=config.MIN_FREQUENCY,
-                                               freq_max=config.MAX_FREQUENCY,
-                                               num_fft_bands=samples,
-                                               sample_rate=config.MIC_RATE)
-samples = None
-mel_y = None
-mel_x = None
-create_mel_bank()
\ No newline at end of file
+    """Switches mel_bank to the filterbank for the current config settings
+
+    The new filterbank is fully built before it is assigned, and the audio
+    loop reads mel_bank once per frame, so it may be called from another
+    thread while audio is being processed.
+    """
+    global mel_bank
+    mel_bank = get_mel_bank(config.N_FFT_BINS, config.MIN_FREQUENCY,
+                            config.MAX_FREQUENCY, stft_settings()[2],
+                            config.MIC_RATE)
+    return mel_bank
+
+
+def current_mel_bank():
+    """Returns mel_bank, creating it when it is first needed"""
+    bank = mel_bank
+    if bank is None:
+        bank = create_mel_bank()
+    return bank
+
+
+mel_bank = None
+"""Mel filterbank applied to the spectrum of every frame
+
+Created by the first call to current_mel_bank rather than at import, so
+that modules which only import dsp for its filters start quickly.
+"""
+
+
+class OnsetDetector:
+    """Detects onsets, such as drum hits, from the spectral flux
+
+    The spectral flux is the total increase in log compressed energy
+    across the mel bands since the previous hop. An onset is detected when
+    the flux exceeds an adaptive threshold of the mean plus a multiple of
+    the standard deviation of the recent flux, and no onset was detected
+    within the refractory period.
+
+    Onsets can be detected from the mel spectrum of every frame with
+    update. Because the frame spectrum is computed over a long window that
+    tapers towards the newest samples, a transient near the end of a frame
+    may only show up in the next frame. With subdivisions greater than 1,
+    push instead splits each new block into shorter hops and detects onsets
+    from a short window ending at every hop. The windows of all the hops
+    are transformed together in a single batched FFT.
+
+    Parameters
+    ----------
+    n_bands : int
+        Number of mel bands.
+    hop_length : int
+        Number of new audio samples in each frame.
+    subdivisions : int
+        Number of hops each frame is split into by push. If 1, onsets are
+        detected with update instead.
+    threshold : float
+        Number of standard deviations the flux must exceed its mean by.
+    history : float
+        Length of the flux history used for the adaptive threshold, in
+        seconds.
+    refractory : float
+        Minimum time between onsets in seconds.
+    rate : int, optional
+        Sampling rate in Hz. Defaults to config.MIC_RATE.
+    channels : int, optional
+        Number of audio channels. If given, blocks have the shape
+        (channels, samples) and the flux is summed over every channel.
+    """
+    def __init__(self, n_bands, hop_length, subdivisions=1, threshold=3.0,
+                 history=1.0, refractory=0.1, rate=None, channels=None):
+        rate = config.MIC_RATE if rate is None else rate
+        assert subdivisions >= 1, 'Invalid number of subdivisions'
+        self.subdivisions = subdivisions
+        self.threshold = threshold
+        hops_per_second = rate * subdivisions / float(hop_length)
+        self._flux = np.zeros(max(int(history * hops_per_second), 2))
+        """Ring buffer of the most recent flux values"""
+        self._index = 0
+        self._hops = 0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._refractory = int(np.ceil(refractory * hops_per_second))
+        self._since_onset = self._refractory
+        shape = () if channels is None else (channels,)
+        # Log compressed spectrum of the previous hop followed by every hop
+        self._log = np.zeros(shape + (subdivisions + 1, n_bands))
+        self._diff = np.zeros(shape + (subdivisions, n_bands))
+        self._scale = np.zeros((subdivisions, 1))
+        self._axes = tuple(i for i in range(len(shape) + 2)
+                           if i != len(shape))
+        """Axes summed over for the flux of each hop"""
+        self.gain = ExpFilter(0.1, alpha_decay=0.01, alpha_rise=0.99)
+        """Peak mel energy that the log compression is relative to"""
+        self.strength = 0.0
+        """Largest flux of the latest frame relative to the threshold.
+        Values above 1 are onsets, unless in the refractory period."""
+        self.beat = False
+        """Whether an onset was detected in the latest frame"""
+        self.beats = 0
+        """Total number of onsets detected"""
+        self._keep = False
+        if subdivisions > 1:
+            window_length = 2 * -(-hop_length // subdivisions)
+            n_fft = 2**int(np.ceil(np.log2(window_length)))
+            self.window, _ = _stft_plan(window_length, n_fft, rate)
+            """Hamming window of the short window of each hop"""
+            self._mel_bank_settings = (n_bands, n_fft, rate)
+            self.mel_bank = None
+            """Mel filterbank of the short windows, for the frequency range
+            in config when it was last used"""
+            self._frequency_range = None
+            self.samples = RollingWindow(window_length + hop_length, channels)
+            """Newest block and the samples before it"""
+            # Sample indices of the short window ending at every hop
+            ends = np.linspace(0, hop_length, subdivisions + 1)[1:]
+            self._windows = (ends.astype(int)[:, np.newaxis] +
+                             np.arange(window_length))
+            self._samples = np.zeros(shape + self._windows.shape,
+                                     dtype=np.float32)
+            self._padded = np.zeros(shape + (subdivisions, n_fft),
+                                    dtype=np.float32)
+            self._mel = np.zeros(shape + (subdivisions, n_bands))
+
+    def _detect(self, mel, keep):
+        """Detects onsets in the mel spectrum of every hop of a frame
+
+        mel has the shape (..., subdivisions, n_bands).
+        """
+        log, diff, scale = self._log, self._diff, self._scale
+        # log(1 + 100 x) is close to linear for quiet bands and logarithmic
+        # for loud ones, so soft and loud hits give comparable flux
+        for i, peak in enumerate(np.max(mel, axis=self._axes)):
+            scale[i] = 100.0 / self.gain.update(max(peak, 1e-12))
+        np.multiply(mel, scale, out=log[..., 1:, :])
+        np.log1p(log[..., 1:, :], out=log[..., 1:, :])
+        np.subtract(log[..., 1:, :], log[..., :-1, :], out=diff)
+        np.maximum(diff, 0.0, out=diff)
+        log[..., 0, :] = log[..., -1, :]
+        if not self._keep:
+            self.strength = 0.0
+            self.beat = False
+        self._keep = keep
+        for flux in np.sum(diff, axis=self._axes).tolist():
+            # Adaptive threshold from running sums over the flux history
+            n = min(self._hops, len(self._flux))
+            limit = 0.0
+            if n:
+                mean = self._sum / n
+                variance = max(self._sum_squares / n - mean**2, 0.0)
+                limit = mean + self.threshold * variance**0.5
+            old = self._flux[self._index]
+            self._sum += flux - old
+            self._sum_squares += flux**2 - old**2
+            self._flux[self._index] = flux
+            self._index = (self._index + 1) % len(self._flux)
+            self._hops += 1
+            if self._index == 0:
+                # Recompute the sums once per history to bound rounding
+                self._sum = float(np.sum(self._flux))
+                self._sum_squares = float(np.dot(self._flux, self._flux))
+            strength = flux / limit if limit > 0.0 else 0.0
+            self.strength = max(self.strength, strength)
+            self._since_onset += 1
+            if (strength > 1.0 and self._since_onset > self._refractory and
+                    n == len(self._flux)):
+                self._since_onset = 0
+                self.beats += 1
+                self.beat = True
+        return self.beat
+
+    def update(self, mel, keep=False):
+        """Detects onsets from the mel spectrum of a new frame
+
+        Parameters
+        ----------
+        mel : np.array
+            Mel spectrum with n_bands values, or one row of n_bands values
+            for each channel.
+        keep : bool
+            If True, the frame is not rendered, so beat and strength are
+            kept and combined with those of the next frame.
+
+        Returns
+        -------
+        beat : bool
+            Whether an onset was detected.
+        """
+        assert self.subdivisions == 1, 'Use push when subdivisions > 1'
+        return self._detect(mel[..., np.newaxis, :], keep)
+
+    def push(self, samples, keep=False):
+        """Detects onsets in a new block of hop_length int16 samples
+
+        Returns whether an onset was detected in any hop of the block. If
+        keep is True, the block is not rendered, so beat and strength are
+        kept and combined with those of the next block.
+        """
+        assert self.subdivisions > 1, 'Use update when subdivisions == 1'
+        self.samples.push(samples)
+        np.take(self.samples.latest(), self._windows, axis=-1,
+                out=self._samples, mode='clip')
+        np.multiply(self._samples, self.window,
+                    out=self._padded[..., :len(self.window)])
+        spectrum = np.abs(np.fft.rfft(self._padded, axis=-1))
+        frequency_range = (config.MIN_FREQUENCY, config.MAX_FREQUENCY)
+        if frequency_range != self._frequency_range:
+            # Follow the frequency range, which the GUI may change
+            n_bands, n_fft, rate = self._mel_bank_settings
+            self.mel_bank = get_mel_bank(n_bands, frequency_range[0],
+                                         frequency_range[1], n_fft, rate)
+            self._frequency_range = frequency_range
+        self.mel_bank.apply(spectrum, out=self._mel)
+        # Energy, as in the mel spectrum of each frame
+        np.square(self._mel, out=self._mel)
+        return self._detect(self._mel, keep)
@@ -0,0 +1,219 @@
+"""Visualization effects that map the mel spectrum onto the LED strip
+
+Each effect is a class that owns all of its state, sized for one strip
+length and number of mel bins when it is created. Rendering writes the
+pixel values into an array supplied by the caller, so a frame is rendered
+without allocating any arrays, and several effects can run side by side
+without affecting one another.
+
+Effects are registered by name in EFFECTS:
+
+    effect = effects.create('spectrum', n_pixels=60, n_bins=24)
+    frame = np.zeros((3, 60))
+    effect.render(mel, frame)
+"""
+from __future__ import print_function
+from __future__ import division
+import collections
+import numpy as np
+import config
+import dsp
+
+
+class Effect:
+    """Base class of visualization effects
+
+    Parameters
+    ----------
+    n_pixels : int, optional
+        Number of pixels rendered. Defaults to config.N_PIXELS.
+    n_bins : int, optional
+        Number of mel bins in the input spectrum.
+        Defaults to config.N_FFT_BINS.
+    onsets : dsp.OnsetDetector, optional
+        Onset detector updated before each frame is rendered, whose beat
+        and strength the effect may react to.
+    """
+    name = None
+    """Name of the effect in EFFECTS"""
+    uses_onsets = False
+    """Whether the effect reacts to onsets, so they need to be detected"""
+
+    def __init__(self, n_pixels=None, n_bins=None, onsets=None):
+        self.n_pixels = config.N_PIXELS if n_pixels is None else n_pixels
+        self.n_bins = config.N_FFT_BINS if n_bins is None else n_bins
+        self.onsets = onsets
+        self.half = (self.n_pixels + 1) // 2
+        """Number of pixels in each mirrored half of the output"""
+
+    def render(self, mel, out):
+        """Renders the effect for a new mel spectrum
+
+        Parameters
+        ----------
+        mel : np.array
+            Normalized mel spectrum with n_bins values.
+        out : np.array
+            Array with shape (3, n_pixels) that receives the pixel values.
+
+        Returns
+        -------
+        out : np.array
+            The output array.
+        """
+        raise NotImplementedError
+
+    def _mirror(self, half, out):
+        """Writes half, and its mirror image to the left of it, to out
+
+        For an odd number of pixels the center pixel is shared by both
+        halves.
+        """
+        out[:, :self.half] = half[:, ::-1]
+        out[:, self.n_pixels - self.half:] = half
+        return out
+
+
+class Scroll(Effect):
+    """Effect that originates in the center and scrolls outwards"""
+    name = 'scroll'
+    uses_onsets = True
+
+    def __init__(self, n_pixels=None, n_bins=None, onsets=None):
+        Effect.__init__(self, n_pixels, n_bins, onsets)
+        self.p = np.tile(1.0, (3, self.half))
+        self.gain = dsp.ExpFilter(np.tile(0.01, self.n_bins),
+                                  alpha_decay=0.001, alpha_rise=0.99)
+        self._y = np.zeros(self.n_bins)
+
+    def render(self, mel, out):
+        y, p = self._y, self.p
+        np.power(mel, 2.0, out=y)
+        self.gain.update(y)
+        y /= self.gain.value
+        y *= 255.0
+        r = int(np.max(y[:len(y) // 3]))
+        g = int(np.max(y[len(y) // 3: 2 * len(y) // 3]))
+        b = int(np.max(y[2 * len(y) // 3:]))
+        if self.onsets is not None and self.onsets.beat:
+            # Flash the new color at full brightness on an onset, instead of
+            # waiting for the smoothed spectrum to catch up
+            peak = max(r, g, b)
+            if peak > 0:
+                r, g, b = (255 * c // peak for c in (r, g, b))
+            else:
+                r = g = b = 255
+        # Scrolling effect window
+        p[:, 1:] = p[:, :-1]
+        p *= 0.98
+        dsp.gaussian_blur(p, sigma=0.2, out=p)
+        # Create new color originating at the center
+        p[0, 0] = r
+        p[1, 0] = g
+        p[2, 0] = b
+        return self._mirror(p, out)
+
+
+class Energy(Effect):
+    """Effect that expands from the center with increasing sound energy"""
+    name = 'energy'
+
+    def __init__(self, n_pixels=None, n_bins=None, onsets=None):
+        Effect.__init__(self, n_pixels, n_bins, onsets)
+        self.p = np.tile(1.0, (3, self.half))
+        self.p_filt = dsp.ExpFilter(np.tile(1, (3, self.half)),
+                                    alpha_decay=0.1, alpha_rise=0.99)
+        self.gain = dsp.ExpFilter(np.tile(0.01, self.n_bins),
+                                  alpha_decay=0.001, alpha_rise=0.99)
+        self._y = np.zeros(self.n_bins)
+
+    def render(self, mel, out):
+        y, p = self._y, self.p
+        y[:] = mel
+        self.gain.update(y)
+        y /= self.gain.value
+        # Scale by the width of the LED strip
+        y *= float(self.half - 1)
+        # Map color channels according to energy in the different freq bands
+        np.power(y, 0.9, out=y)
+        r = int(np.mean(y[:len(y) // 3]))
+        g = int(np.mean(y[len(y) // 3: 2 * len(y) // 3]))
+        b = int(np.mean(y[2 * len(y) // 3:]))
+        # Assign color to different frequency regions
+        p[0, :r] = 255.0
+        p[0, r:] = 0.0
+        p[1, :g] = 255.0
+        p[1, g:] = 0.0
+        p[2, :b] = 255.0
+        p[2, b:] = 0.0
+        self.p_filt.update(p)
+        np.round(self.p_filt.value, out=p)
+        # Apply substantial blur to smooth the edges
+        dsp.gaussian_blur(p, sigma=4.0, out=p)
+        return self._mirror(p, out)
+
+
+class Spectrum(Effect):
+    """Effect that maps the Mel filterbank frequencies onto the LED strip"""
+    name = 'spectrum'
+
+    def __init__(self, n_pixels=None, n_bins=None, onsets=None):
+        Effect.__init__(self, n_pixels, n_bins, onsets)
+        n = self.half
+        # Linear interpolation of the mel bins onto half of the strip
+        x = np.linspace(0, 1, n) * (self.n_bins - 1)
+        self._lo = np.clip(np.floor(x), 0, max(self.n_bins - 2, 0)).astype(int)
+        self._hi = np.minimum(self._lo + 1, self.n_bins - 1)
+        self._frac = x - self._lo
+        self.common_mode = dsp.ExpFilter(np.tile(0.01, n),
+                                         alpha_decay=0.99, alpha_rise=0.01)
+        self.filters = dsp.ExpFilterBank(np.tile(0.01, (2, n)),
+                                         alpha_decay=[0.2, 0.1],
+                                         alpha_rise=[0.99, 0.5])
+        """Red and blue channel filters, updated together"""
+        self._prev = np.tile(0.01, n)
+        self._y = np.zeros(n)
+        self._upper = np.zeros(n)
+        self._p = np.zeros((3, n))
+
+    def _interpolate(self, mel, y):
+        if self.n_bins == len(y):
+            y[:] = mel
+            return y
+        np.take(mel, self._lo, out=y)
+        np.take(mel, self._hi, out=self._upper)
+        self._upper -= y
+        self._upper *= self._frac
+        y += self._upper
+        return y
+
+    def render(self, mel, out):
+        y, p = self._interpolate(mel, self._y), self._p
+        self.common_mode.update(y)
+        # Color channel mappings
+        np.subtract(y, self._prev, out=p[1])
+        np.abs(p[1], out=p[1])
+        self._prev[:] = y
+        np.subtract(y, self.common_mode.value, out=self.filters.input[0])
+        self.filters.input[1] = y
+        self.filters.update()
+        p[0] = self.filters.value[0]
+        p[2] = self.filters.value[1]
+        self._mirror(p, out)
+        out *= 255
+        return out
+
+
+EFFECTS = collections.OrderedDict(
+    (effect.name, effect) for effect in (Scroll, Energy, Spectrum))
+"""Effect classes by name"""
+
+
+def create(name, n_pixels=None, n_bins=None, onsets=None):
+    """Returns a new instance of the named effect"""
+    try:
+        effect = EFFECTS[name]
+    except KeyError:
+        raise ValueError('Unknown effect {!r}, expected one of {}'.format(
+            name, ', '.join(EFFECTS)))
+    return effect(n_pixels, n_bins, onsets)
@@ -0,0 +1,52 @@
+"""Stand-in for the blinkstick module
+
+Provides the parts of the BlinkStick API that led.py uses, so the Blinkstick
+backend can be benchmarked and tested without a BlinkStick connected. Every
+report is recorded instead of being sent over USB.
+
+To run the visualization with a simulated BlinkStick, set
+DEVICE = 'blinkstick' in config.py and replace the blinkstick import in
+led.py with:
+
+    import fake_blinkstick as blinkstick
+"""
+from __future__ import print_function
+from __future__ import division
+
+MAX_LEDS_PER_REPORT = 64
+"""Largest number of LEDs the BlinkStick accepts in a single report"""
+
+
+class BlinkStick:
+    """BlinkStick that records the LED data it is sent
+
+    Parameters
+    ----------
+    channels : int
+        Number of output channels. The BlinkStick Pro has 3.
+    """
+    def __init__(self, channels=3):
+        self.channels = channels
+        self.calls = []
+        """(channel, data) of every call to set_led_data"""
+        self.led_data = {}
+        """Most recent GRB data sent to each channel"""
+
+    def set_led_data(self, channel, data):
+        if not 0 <= channel < self.channels:
+            raise ValueError('Invalid channel {}'.format(channel))
+        if len(data) > 3 * MAX_LEDS_PER_REPORT:
+            raise ValueError('Too many LEDs in report: {}'.format(
+                len(data) // 3))
+        data = list(data)
+        self.calls.append((channel, data))
+        self.led_data[channel] = data
+
+    def reset(self):
+        """Clears the recorded calls"""
+        self.calls = []
+
+
+def find_first():
+    """Returns a new simulated BlinkStick"""
+    return BlinkStick()
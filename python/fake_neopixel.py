@@ -0,0 +1,85 @@
+"""Stand-in for the rpi_ws281x neopixel module
+
+Provides the parts of neopixel.Adafruit_NeoPixel that led.py uses, so the
+Raspberry Pi backend can be benchmarked and tested on any computer. Pixel
+values are stored in memory, and every write and show is recorded.
+
+To run the visualization with a simulated Raspberry Pi LED strip, set
+DEVICE = 'pi' in config.py and replace the neopixel import in led.py with:
+
+    import fake_neopixel as neopixel
+"""
+from __future__ import print_function
+from __future__ import division
+import numpy as np
+
+
+class LEDData:
+    """Packed 24-bit color of each pixel, indexed like strip._led_data
+
+    Supports integer and slice indexing, like the _LED_Data class of the
+    rpi_ws281x library.
+    """
+    def __init__(self, n_pixels):
+        self.values = np.zeros(n_pixels, dtype=np.uint32)
+        self.writes = 0
+        """Number of assignments"""
+        self.pixels_written = 0
+        """Number of pixel values assigned"""
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return self.values[pos].tolist()
+        return int(self.values[pos])
+
+    def __setitem__(self, pos, value):
+        if isinstance(pos, slice):
+            n = len(range(*pos.indices(len(self.values))))
+            if len(value) != n:
+                raise ValueError('Expected {} values, got {}'.format(
+                    n, len(value)))
+            self.values[pos] = value
+            self.pixels_written += n
+        else:
+            self.values[pos] = value
+            self.pixels_written += 1
+        self.writes += 1
+
+
+class Adafruit_NeoPixel:
+    """LED strip that records its pixel values instead of displaying them"""
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False,
+                 brightness=255, channel=0, strip_type=None):
+        self._led_data = LEDData(num)
+        self.pin = pin
+        self.brightness = brightness
+        self.started = False
+        self.shows = 0
+        """Number of times the strip has been updated"""
+        self.shown = np.zeros(num, dtype=np.uint32)
+        """Packed pixel values at the most recent show"""
+
+    def begin(self):
+        self.started = True
+
+    def show(self):
+        self.shows += 1
+        self.shown[:] = self._led_data.values
+
+    def setPixelColor(self, n, color):
+        self._led_data[n] = color
+
+    def getPixelColor(self, n):
+        return self._led_data[n]
+
+    def numPixels(self):
+        return len(self._led_data)
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def getBrightness(self):
+        return self.brightness
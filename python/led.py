@@ -1,13 +1,18 @@
 from __future__ import print_function
 from __future__ import division
 
-import platform
 import numpy as np
 import config
+import timing
+
+BLINKSTICK_CHANNELS = 3
+"""Number of output channels of the BlinkStick Pro"""
 
 # ESP8266 uses WiFi communication
 if config.DEVICE == 'esp8266':
     import socket
+    import protocol
+    import udp
     _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 # Raspberry Pi controls the LED strip directly
 elif config.DEVICE == 'pi':
@@ -17,13 +22,18 @@ elif config.DEVICE == 'pi':
                                        config.LED_INVERT, config.BRIGHTNESS)
     strip.begin()
 elif config.DEVICE == 'blinkstick':
+    # Segment i of the strip is sent to channel i
+    _max_pixels = BLINKSTICK_CHANNELS * config.BLINKSTICK_LEDS_PER_CHANNEL
+    if config.N_PIXELS > _max_pixels:
+        raise ValueError('BlinkStick supports at most {} pixels'.format(
+            _max_pixels))
     from blinkstick import blinkstick
     import signal
     import sys
     #Will turn all leds off when invoked.
     def signal_handler(signal, frame):
-        all_off = [0]*(config.N_PIXELS*3)
-        stick.set_led_data(0, all_off)
+        for channel, start, end in _blinkstick_segments():
+            stick.set_led_data(channel, [0] * (3 * (end - start)))
         sys.exit(0)
 
     stick = blinkstick.find_first()
@@ -31,113 +41,228 @@ elif config.DEVICE == 'blinkstick':
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
 
-_gamma = np.load(config.GAMMA_TABLE_PATH)
+_gamma = np.load(config.GAMMA_TABLE_PATH).astype(np.uint8)
 """Gamma lookup table used for nonlinear brightness correction"""
 
-_prev_pixels = np.tile(253, (3, config.N_PIXELS))
+_gamma_curve = 255.0 * (np.arange(256) / 255.0)**config.DITHERING_GAMMA
+"""Gamma correction curve without rounding, used for dithering"""
+
+_prev_pixels = np.full((3, config.N_PIXELS), 253, dtype=np.uint8)
 """Pixel values that were most recently displayed on the LED strip"""
 
+_clipped = np.zeros((3, config.N_PIXELS), dtype=np.uint8)
+"""Pixel values clipped to 0-255, before gamma correction"""
+
+_frame = np.zeros((3, config.N_PIXELS), dtype=np.uint8)
+"""Gamma corrected pixel values of the frame being sent"""
+
+_packed = np.zeros(config.N_PIXELS, dtype=np.uint32)
+"""Pixel values packed into 32 bit integers for the Raspberry Pi"""
+
+_dither = np.zeros((3, config.N_PIXELS))
+"""Buffer for the unrounded gamma corrected values of a dithered frame"""
+
+_dither_offsets = (np.arange(3 * config.N_PIXELS) * 0.618034 % 1.0).reshape(
+    3, config.N_PIXELS)
+"""Rounding threshold of each pixel, spread evenly to avoid visible patterns"""
+
+_dither_threshold = np.zeros((3, config.N_PIXELS))
+_dither_step = 0
+
 pixels = np.tile(1, (3, config.N_PIXELS))
 """Pixel values for the LED strip"""
 
-_is_python_2 = int(platform.python_version_tuple()[0]) == 2
+packets_sent = 0
+"""Total number of packets sent to the LED strip controllers"""
+
+bytes_sent = 0
+"""Total number of bytes sent to the LED strip controllers"""
+
+recorder = None
+"""Recorder that displayed frames are appended to, created by the first
+frame displayed while config.RECORDING_PATH is set"""
+
+
+def _record(frame):
+    """Appends a frame to the recording at config.RECORDING_PATH"""
+    global recorder
+    if recorder is None:
+        import atexit
+        import recording
+        recorder = recording.Recorder(config.RECORDING_PATH)
+        atexit.register(recorder.close)
+    recorder.write(frame)
+
+
+def _output_frame():
+    """Returns the pixel values to send to the LED strip as uint8 values
+
+    Values are clipped to 0-255, truncated, and optionally gamma corrected
+    without any temporary arrays. The returned array is shared by every
+    backend and is overwritten on the next call.
+    """
+    global _dither_step
+    np.clip(pixels, 0, 255, out=_clipped, casting='unsafe')
+    if not config.SOFTWARE_GAMMA_CORRECTION:
+        return _clipped
+    if not config.SOFTWARE_DITHERING:
+        np.take(_gamma, _clipped, out=_frame, mode='clip')
+        return _frame
+    # Round each value up or down depending on a threshold that cycles
+    # through 8 evenly spaced steps, so the average over 8 frames is within
+    # 1/8 of the unrounded gamma corrected value
+    np.take(_gamma_curve, _clipped, out=_dither, mode='clip')
+    np.add(_dither_offsets, _dither_step / 8.0, out=_dither_threshold)
+    np.mod(_dither_threshold, 1.0, out=_dither_threshold)
+    np.add(_dither, _dither_threshold, out=_dither)
+    np.floor(_dither, out=_dither)
+    np.copyto(_frame, _dither, casting='unsafe')
+    _dither_step = (_dither_step + 1) % 8
+    return _frame
+
+
+class ESP8266:
+    """ESP8266 controller that displays part or all of the LED strip
+
+    Each controller keeps the pixel values it was last sent, so that only
+    the pixels that have changed are sent to it.
+
+    Parameters
+    ----------
+    ip : str
+        IP address of the ESP8266.
+    port : int, optional
+        UDP port of the ESP8266. Defaults to config.UDP_PORT.
+    pixels : slice or sequence of int, optional
+        Pixels of the rendered frame that are shown by this controller, in
+        the order of the controller's LEDs. A slice selects a segment of the
+        strip, a reversed slice such as ``slice(None, None, -1)`` mirrors it,
+        and a sequence of indices remaps pixels arbitrarily. Defaults to the
+        whole strip.
+    protocol : int, optional
+        Version of the packet format understood by the controller's firmware.
+        Defaults to config.ESP8266_PROTOCOL. See the protocol module.
+    """
+    def __init__(self, ip, port=None, pixels=None, protocol=None):
+        self.address = (ip, config.UDP_PORT if port is None else port)
+        if pixels is None:
+            pixels = slice(None)
+        if not isinstance(pixels, slice):
+            pixels = np.asarray(pixels, dtype=int)
+        self.pixels = pixels
+        self.protocol = config.ESP8266_PROTOCOL if protocol is None else protocol
+        n = len(np.arange(config.N_PIXELS)[pixels])
+        if self.protocol == 1 and n > 256:
+            raise ValueError('Protocol version 1 supports at most 256 pixels')
+        self.prev_pixels = np.full((3, n), 253, dtype=np.uint8)
+
+    def packets(self, p):
+        """Returns the (packet, address) tuples that update this controller"""
+        p = p[:, self.pixels]
+        # Pixels that have changed since the last update
+        changed = np.any(p != self.prev_pixels, axis=0)
+        self.prev_pixels[:] = p
+        if self.protocol == 1:
+            packets = protocol.encode_legacy(p, changed)
+        else:
+            packets = protocol.encode(p, changed)
+        return [(packet, self.address) for packet in packets]
+
+
+def _create_devices():
+    if config.ESP8266_DEVICES is None:
+        return [ESP8266(config.UDP_IP, config.UDP_PORT)]
+    return [ESP8266(**device) for device in config.ESP8266_DEVICES]
+
+
+if config.DEVICE == 'esp8266':
+    devices = _create_devices()
+    """ESP8266 controllers that the LED strip is displayed on"""
+
 
 def _update_esp8266():
-    """Sends UDP packets to ESP8266 to update LED strip values
+    """Sends UDP packets to the ESP8266 controllers to update LED strip values
 
     The ESP8266 will receive and decode the packets to determine what values
-    to display on the LED strip. The communication protocol supports LED strips
-    with a maximum of 256 LEDs.
-
-    The packet encoding scheme is:
-        |i|r|g|b|
-    where
-        i (0 to 255): Index of LED to change (zero-based)
-        r (0 to 255): Red value of LED
-        g (0 to 255): Green value of LED
-        b (0 to 255): Blue value of LED
+    to display on the LED strip. The packet formats are described in the
+    protocol module.
+
+    The frame is rendered once and the part shown by each controller in
+    ``devices`` is encoded separately. The packets for all of the controllers
+    are then sent together in a single batch.
     """
-    global pixels, _prev_pixels
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optionally apply gamma correc tio
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    MAX_PIXELS_PER_PACKET = 126
-    # Pixel indices
-    idx = range(pixels.shape[1])
-    idx = [i for i in idx if not np.array_equal(p[:, i], _prev_pixels[:, i])]
-    n_packets = len(idx) // MAX_PIXELS_PER_PACKET + 1
-    idx = np.array_split(idx, n_packets)
-    for packet_indices in idx:
-        m = '' if _is_python_2 else []
-        for i in packet_indices:
-            if _is_python_2:
-                m += chr(i) + chr(p[0][i]) + chr(p[1][i]) + chr(p[2][i])
-            else:
-                m.append(i)  # Index of pixel to change
-                m.append(p[0][i])  # Pixel red value
-                m.append(p[1][i])  # Pixel green value
-                m.append(p[2][i])  # Pixel blue value
-        m = m if _is_python_2 else bytes(m)
-        _sock.sendto(m, (config.UDP_IP, config.UDP_PORT))
-    _prev_pixels = np.copy(p)
+    global packets_sent, bytes_sent
+    p = _output_frame()
+    messages = []
+    for device in devices:
+        messages.extend(device.packets(p))
+    t = timing.start()
+    udp.send_batch(_sock, messages)
+    timing.stop('send', t)
+    packets_sent += len(messages)
+    bytes_sent += sum(len(packet) for packet, _ in messages)
 
 
 def _update_pi():
     """Writes new LED values to the Raspberry Pi's LED strip
 
     Raspberry Pi uses the rpi_ws281x to control the LED strip directly.
-    This function updates the LED strip with new values.
+    This function updates the LED strip with new values. Only the span of
+    pixels that have changed is written, and the strip is not updated at
+    all when no pixel has changed.
     """
-    global pixels, _prev_pixels
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    # Encode 24-bit LED values in 32 bit integers
-    r = np.left_shift(p[0][:].astype(int), 8)
-    g = np.left_shift(p[1][:].astype(int), 16)
-    b = p[2][:].astype(int)
-    rgb = np.bitwise_or(np.bitwise_or(r, g), b)
-    # Update the pixels
-    for i in range(config.N_PIXELS):
-        # Ignore pixels if they haven't changed (saves bandwidth)
-        if np.array_equal(p[:, i], _prev_pixels[:, i]):
-            continue
-        #strip._led_data[i] = rgb[i]
-        strip._led_data[i] = int(rgb[i])
-    _prev_pixels = np.copy(p)
+    p = _output_frame()
+    # Ignore pixels if they haven't changed (saves bandwidth)
+    changed = np.flatnonzero(np.any(p != _prev_pixels, axis=0))
+    if len(changed) == 0:
+        return
+    # Encode 24-bit LED values in 32 bit integers as GRB
+    rgb = _packed
+    rgb[:] = p[1]
+    rgb <<= 8
+    rgb |= p[0]
+    rgb <<= 8
+    rgb |= p[2]
+    # Write the span of pixels that have changed in a single assignment
+    start, end = changed[0], changed[-1] + 1
+    strip._led_data[start:end] = rgb[start:end].tolist()
+    _prev_pixels[:] = p
     strip.show()
 
+
+def _blinkstick_segments():
+    """Returns the channel, first pixel and end pixel of each strip segment"""
+    n = config.BLINKSTICK_LEDS_PER_CHANNEL
+    return [(channel, start, min(start + n, config.N_PIXELS))
+            for channel, start in enumerate(range(0, config.N_PIXELS, n))]
+
+
 def _update_blinkstick():
     """Writes new LED values to the Blinkstick.
         This function updates the LED strip with new values.
+        The strip is sent in segments of BLINKSTICK_LEDS_PER_CHANNEL LEDs,
+        one per channel, and segments that have not changed are not sent.
     """
-    global pixels
-    
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    # Read the rgb values
-    r = p[0][:].astype(int)
-    g = p[1][:].astype(int)
-    b = p[2][:].astype(int)
-
-    #create array in which we will store the led states
-    newstrip = [None]*(config.N_PIXELS*3)
-
-    for i in range(config.N_PIXELS):
-        # blinkstick uses GRB format
-        newstrip[i*3] = g[i]
-        newstrip[i*3+1] = r[i]
-        newstrip[i*3+2] = b[i]
-    #send the data to the blinkstick
-    stick.set_led_data(0, newstrip)
+    global packets_sent, bytes_sent
+    p = _output_frame()
+    # Skip the USB transfer if the frame has not changed
+    if np.array_equal(p, _prev_pixels):
+        return
+    # blinkstick uses GRB format
+    grb = p[[1, 0, 2]].T
+    for channel, start, end in _blinkstick_segments():
+        if np.array_equal(p[:, start:end], _prev_pixels[:, start:end]):
+            continue
+        data = grb[start:end].ravel().tolist()
+        stick.set_led_data(channel, data)
+        packets_sent += 1
+        bytes_sent += len(data)
+    _prev_pixels[:] = p
 
 
 def update():
     """Updates the LED strip values"""
+    t = timing.start()
     if config.DEVICE == 'esp8266':
         _update_esp8266()
     elif config.DEVICE == 'pi':
@@ -146,6 +271,10 @@ def update():
         _update_blinkstick()
     else:
         raise ValueError('Invalid device selected')
+    if config.RECORDING_PATH is not None:
+        # Every backend leaves the clipped frame in _clipped
+        _record(_clipped)
+    timing.stop('led', t)
 
 
 # Execute this file to run a LED strand test
@@ -30,7 +30,8 @@ Functions
 ---------
 """
 
-from numpy import abs, append, arange, insert, linspace, log10, round, zeros
+from numpy import (abs, append, arange, errstate, insert, linspace, log10,
+                   maximum, minimum, newaxis, round)
 
 
 def hertz_to_mel(freq):
@@ -134,19 +135,18 @@ def compute_melmat(num_mel_bands=12, freq_min=64, freq_max=8000,
     lower_edges_hz = mel_to_hertz(lower_edges_mel)
     upper_edges_hz = mel_to_hertz(upper_edges_mel)
     freqs = linspace(0.0, sample_rate / 2.0, num_fft_bands)
-    melmat = zeros((num_mel_bands, num_fft_bands))
 
-    for imelband, (center, lower, upper) in enumerate(zip(
-            center_frequencies_hz, lower_edges_hz, upper_edges_hz)):
-
-        left_slope = (freqs >= lower) == (freqs <= center)
-        melmat[imelband, left_slope] = (
-            (freqs[left_slope] - lower) / (center - lower)
-        )
-
-        right_slope = (freqs >= center) == (freqs <= upper)
-        melmat[imelband, right_slope] = (
-            (upper - freqs[right_slope]) / (upper - center)
-        )
+    # Compute every band at once, with one row per band. Each triangle is
+    # the smaller of its rising and falling slopes, clipped at zero.
+    center = center_frequencies_hz[:, newaxis]
+    lower = lower_edges_hz[:, newaxis]
+    upper = upper_edges_hz[:, newaxis]
+    melmat = freqs - lower
+    falling = upper - freqs
+    with errstate(divide='ignore', invalid='ignore'):
+        melmat /= center - lower
+        falling /= upper - center
+    minimum(melmat, falling, out=melmat)
+    maximum(melmat, 0.0, out=melmat)
 
     return melmat, (center_frequencies_mel, freqs)
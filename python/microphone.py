@@ -1,26 +1,123 @@
 import time
 import numpy as np
-import pyaudio
 import config
+import dsp
+import timing
 
+overflows = 0
+"""Total number of times the audio input buffer has overflowed"""
 
-def start_stream(callback):
+scheduler = None
+"""FrameScheduler of the running audio stream, or None"""
+
+
+class FrameScheduler:
+    """Decides which blocks of audio are rendered as frames
+
+    Every block of audio is added to the analysis window, but a frame is
+    only rendered for a block when the next frame is due. Each frame has a
+    deadline one frame period after the previous one. For every block the
+    scheduler decides to:
+
+    - coalesce the block into the analysis window without rendering it,
+      when newer blocks are already waiting to be read, or when the next
+      deadline is still more than half a frame away
+    - render the block on time
+    - render the block late, when the deadline was missed by more than a
+      whole frame. Deadlines then restart from the current time, rather
+      than rendering a burst of frames to catch up.
+
+    Parameters
+    ----------
+    fps : float, optional
+        Target frame rate. Defaults to config.FPS. The frame rate is
+        limited to config._max_led_FPS, the highest rate the LED strip
+        can be refreshed at.
+    """
+    def __init__(self, fps=None):
+        fps = config.FPS if fps is None else fps
+        self.period = 1.0 / min(fps, config._max_led_FPS)
+        """Time between frame deadlines in seconds"""
+        self._min_interval = 1.0 / config._max_led_FPS
+        self.deadline = None
+        """Time by which the next frame should be rendered"""
+        self._prev_render = None
+        self.rendered = 0
+        """Number of frames rendered"""
+        self.skipped = 0
+        """Number of blocks coalesced into the window without rendering"""
+        self.late = 0
+        """Number of frames rendered more than a frame period late"""
+
+    def should_render(self, backlog=0, now=None):
+        """Returns whether to render a frame for the block just read
+
+        Parameters
+        ----------
+        backlog : int
+            Number of complete blocks already waiting to be read.
+        now : float, optional
+            Current time in seconds. Defaults to the current clock time.
+        """
+        now = timing.clock() if now is None else now
+        if self.deadline is None:
+            self.deadline = now
+        if (backlog > 0 or now < self.deadline - 0.5 * self.period or
+                (self._prev_render is not None and
+                 now - self._prev_render < self._min_interval)):
+            self.skipped += 1
+            timing.count('skipped_frames')
+            return False
+        if now > self.deadline + self.period:
+            self.late += 1
+            timing.count('late_frames')
+            self.deadline = now
+        self.deadline += self.period
+        self._prev_render = now
+        self.rendered += 1
+        return True
+
+
+def start_stream(callback, skip=None):
+    """Reads audio from the microphone forever
+
+    Parameters
+    ----------
+    callback : callable
+        Function that is called with blocks of int16 samples, with the
+        shape (channels, samples).
+    skip : callable, optional
+        Function that is called with the blocks a FrameScheduler decides
+        not to render, such as ``visualization.skip_frame``, which adds them
+        to the analysis window. If None, every block is passed to callback.
+    """
+    global overflows, scheduler
+    import pyaudio
     p = pyaudio.PyAudio()
-    frames_per_buffer = int(config.MIC_RATE / config.FPS)
+    frames_per_buffer = dsp.stft_settings()[1]
     stream = p.open(format=pyaudio.paInt16,
-                    channels=1,
+                    channels=config.N_CHANNELS,
                     rate=config.MIC_RATE,
                     input=True,
                     frames_per_buffer=frames_per_buffer)
-    overflows = 0
+    if skip is not None:
+        scheduler = FrameScheduler()
     prev_ovf_time = time.time()
     while True:
         try:
             y = np.frombuffer(stream.read(frames_per_buffer, exception_on_overflow=False), dtype=np.int16)
-            y = y.astype(np.float32)
-            stream.read(stream.get_read_available(), exception_on_overflow=False)
-            callback(y)
+            # Deinterleave into one row of samples per channel
+            y = y.reshape(-1, config.N_CHANNELS).T
+            if skip is None:
+                callback(y)
+                continue
+            backlog = stream.get_read_available() // frames_per_buffer
+            if scheduler.should_render(backlog):
+                callback(y)
+            else:
+                skip(y)
         except IOError:
+            timing.count('audio_overflows')
             overflows += 1
             if time.time() > prev_ovf_time + 1:
                 prev_ovf_time = time.time()
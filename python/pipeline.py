@@ -0,0 +1,214 @@
+"""Runs audio capture, rendering and LED output on separate threads
+
+The stages are connected by small bounded queues. When a stage falls behind,
+the oldest queued item is discarded in favour of the newest one, so a slow
+LED update can never stall audio capture and stale frames are never shown.
+Given a skip function, no audio is discarded. When rendering falls behind,
+the queued blocks are instead added to the analysis window and only the
+newest one is rendered. Given a FrameScheduler as well, a block is only
+rendered when the next frame is due, so frames are paced at config.FPS.
+"""
+from __future__ import print_function
+from __future__ import division
+import collections
+import threading
+import time
+import config
+import timing
+
+
+class DropOldestQueue:
+    """Bounded queue that discards its oldest item when it is full
+
+    If maxsize is None the queue is unbounded and never discards items.
+    """
+    def __init__(self, maxsize):
+        self._items = collections.deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._ready:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+                timing.count('dropped_frames')
+            self._items.append(item)
+            self._ready.notify()
+
+    def get(self):
+        with self._ready:
+            while not self._items:
+                # Wait with a timeout so that KeyboardInterrupt is delivered
+                self._ready.wait(0.1)
+            return self._items.popleft()
+
+    def get_all(self):
+        """Removes and returns every queued item, waiting for at least one"""
+        with self._ready:
+            while not self._items:
+                self._ready.wait(0.1)
+            items = list(self._items)
+            self._items.clear()
+            return items
+
+
+class Stage:
+    """Processing time statistics for a single pipeline stage"""
+    def __init__(self, name, queue=None):
+        self.name = name
+        self.queue = queue
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        timing.record(self.name, seconds)
+
+    def summary(self):
+        """Returns the mean and max duration in ms and the queue state"""
+        mean = 1000.0 * self.total_time / max(self.count, 1)
+        text = '{} {:.1f}/{:.1f} ms'.format(self.name, mean,
+                                            1000.0 * self.max_time)
+        if self.queue is not None:
+            text += ' (queue {}, dropped {})'.format(len(self.queue),
+                                                    self.queue.dropped)
+        return text
+
+
+class Pipeline:
+    """Three stage audio capture, rendering and LED output pipeline
+
+    Parameters
+    ----------
+    capture : callable
+        Function that reads audio forever and passes each block of samples
+        to the callback it is given, such as ``microphone.start_stream``.
+        It runs on its own thread.
+    render : callable
+        Function that returns the pixel values for a block of samples.
+        It runs on the thread that calls ``run``.
+    output : callable
+        Function that displays rendered pixel values on the LED strip.
+        It runs on its own thread.
+    maxsize : int, optional
+        Maximum number of items waiting between two stages. Defaults to
+        ``config.PIPELINE_QUEUE_SIZE``.
+    skip : callable, optional
+        Function that adds a block of samples to the analysis without
+        rendering it, such as ``visualization.skip_frame``. If given, audio
+        blocks are never discarded. When several blocks are waiting, all
+        but the newest are passed to skip, and only the newest is rendered.
+    scheduler : microphone.FrameScheduler, optional
+        Decides whether the newest block is rendered or passed to skip, so
+        that frames are rendered at the scheduler's frame rate rather than
+        for every block captured. Only used when skip is given.
+    """
+    def __init__(self, capture, render, output, maxsize=None, skip=None,
+                 scheduler=None):
+        if maxsize is None:
+            maxsize = config.PIPELINE_QUEUE_SIZE
+        self.capture = capture
+        self.render = render
+        self.output = output
+        self.skip = skip
+        self.scheduler = scheduler
+        self.skipped = 0
+        """Number of audio blocks added to the analysis without rendering"""
+        self.audio = DropOldestQueue(maxsize if skip is None else None)
+        self.frames = DropOldestQueue(maxsize)
+        self.capture_stage = Stage('capture')
+        self.render_stage = Stage('render', self.audio)
+        self.output_stage = Stage('output', self.frames)
+        self.stages = [self.capture_stage, self.render_stage, self.output_stage]
+        self._prev_block_time = None
+
+    def _captured(self, samples):
+        # Capture time is the time spent waiting for each block of audio
+        now = timing.clock()
+        if self._prev_block_time is not None:
+            self.capture_stage.record(now - self._prev_block_time)
+        self._prev_block_time = now
+        self.audio.put(samples)
+
+    def _output_loop(self):
+        while True:
+            frame = self.frames.get()
+            start = timing.clock()
+            self.output(frame)
+            self.output_stage.record(timing.clock() - start)
+
+    def summary(self, elapsed):
+        """Returns a one line summary of the stage timings since last call
+
+        Parameters
+        ----------
+        elapsed : float
+            Time since the previous call in seconds, used to compute the
+            number of frames displayed per second.
+        """
+        text = 'FPS {:.0f} / {:.0f} | '.format(
+            self.output_stage.count / elapsed, config.FPS)
+        text += ' | '.join(stage.summary() for stage in self.stages)
+        if self.skip is not None:
+            text += ' | skipped {}'.format(self.skipped)
+        if self.skip is not None and self.scheduler is not None:
+            text += ', late {}'.format(self.scheduler.late)
+        for stage in self.stages:
+            stage.reset()
+        return text
+
+    def _next_block(self):
+        """Returns the next block of samples to render
+
+        Every block that is not rendered is passed to skip. A block is only
+        rendered when no newer block is waiting and the scheduler, if any,
+        decides that the next frame is due.
+        """
+        while True:
+            blocks = self.audio.get_all()
+            for i, samples in enumerate(blocks):
+                backlog = len(blocks) - i - 1
+                if self.scheduler is not None:
+                    due = self.scheduler.should_render(backlog)
+                else:
+                    due = backlog == 0
+                    if not due:
+                        timing.count('skipped_frames')
+                if due:
+                    return samples
+                self.skip(samples)
+                self.skipped += 1
+
+    def run(self):
+        """Starts the capture and output threads and renders forever"""
+        for target, args in ((self.capture, (self._captured,)),
+                             (self._output_loop, ())):
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+        prev_summary = time.time()
+        while True:
+            if self.skip is None:
+                samples = self.audio.get()
+            else:
+                samples = self._next_block()
+            start = timing.clock()
+            frame = self.render(samples)
+            self.render_stage.record(timing.clock() - start)
+            self.frames.put(frame)
+            # With instrumentation the stage timings are recorded by timing,
+            # which prints the only report
+            if (config.DISPLAY_FPS and not timing.enabled and
+                    time.time() - 1.0 > prev_summary):
+                now = time.time()
+                print(self.summary(now - prev_summary))
+                prev_summary = now
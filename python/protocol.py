@@ -0,0 +1,189 @@
+"""Packet formats used to send pixel values to the ESP8266
+
+Two versions of the protocol are supported. The version used by the Python
+code is set by config.ESP8266_PROTOCOL and must match the PROTOCOL_VERSION
+set in the ESP8266 firmware (ws2812_controller.ino).
+
+Version 1 sends the pixels that have changed as 4 byte |i|r|g|b| records,
+where i is the 8-bit index of the pixel. It supports at most 256 pixels and
+the strip is updated after every packet.
+
+Version 2 uses 16-bit pixel offsets and supports up to 65536 pixels. Every
+packet starts with a two byte header:
+    |version|flags|
+where version is 2 and the low bits of flags give the packet type. The high
+bit of flags (END_OF_FRAME) is set on the last packet of a frame, and the
+strip is only updated once that packet has been received. There are two
+packet types:
+
+    DELTA packets contain runs of up to 255 consecutive changed pixels:
+        |offset (16-bit)|count (8-bit)|r|g|b|r|g|b|...|offset|count|...
+    FRAME packets contain the values of consecutive pixels from an offset:
+        |offset (16-bit)|r|g|b|r|g|b|...
+
+All 16-bit values are big-endian. For every frame, the encoder sends
+whichever packet type uses fewer bytes.
+"""
+from __future__ import print_function
+from __future__ import division
+import struct
+import numpy as np
+
+VERSION = 2
+"""Latest protocol version"""
+
+DELTA = 0
+"""Packet type containing runs of changed pixels"""
+
+FRAME = 1
+"""Packet type containing consecutive pixels from an offset"""
+
+END_OF_FRAME = 0x80
+"""Flag set on the last packet of a frame"""
+
+MAX_PACKET_SIZE = 1024
+"""Maximum packet size in bytes. Must not exceed BUFFER_LEN in the firmware"""
+
+_HEADER = struct.Struct('>BB')
+_RUN = struct.Struct('>HB')
+_OFFSET = struct.Struct('>H')
+
+
+def encode_legacy(p, changed):
+    """Returns version 1 packets for the pixels that have changed
+
+    Parameters
+    ----------
+    p : np.array
+        Pixel values with shape (3, n_pixels), where n_pixels <= 256.
+    changed : np.array
+        Boolean array that is True for every pixel that has changed.
+    """
+    MAX_PIXELS_PER_PACKET = 126
+    idx = np.flatnonzero(changed)
+    n_packets = len(idx) // MAX_PIXELS_PER_PACKET + 1
+    # Each row holds the |i|r|g|b| values of one changed pixel
+    m = np.empty((len(idx), 4), dtype=np.uint8)
+    m[:, 0] = idx
+    m[:, 1:] = p[:, idx].T
+    return [packet.tobytes() for packet in np.array_split(m, n_packets)]
+
+
+def runs(changed):
+    """Returns the start and length of each run of changed pixels
+
+    Runs separated by a single unchanged pixel are merged, because resending
+    one pixel costs as many bytes as starting a new run.
+    """
+    idx = np.flatnonzero(changed)
+    if len(idx) == 0:
+        return idx, idx
+    breaks = np.flatnonzero(np.diff(idx) > 2)
+    starts = idx[np.concatenate(([0], breaks + 1))]
+    ends = idx[np.concatenate((breaks, [len(idx) - 1]))] + 1
+    return starts, ends - starts
+
+
+def _add_headers(bodies, packet_type):
+    flags = [packet_type] * len(bodies)
+    flags[-1] |= END_OF_FRAME
+    return [_HEADER.pack(VERSION, f) + b''.join(body)
+            for f, body in zip(flags, bodies)]
+
+
+def encode_delta(rgb, starts, lengths):
+    """Returns DELTA packets for runs of pixels
+
+    Parameters
+    ----------
+    rgb : np.array
+        Contiguous uint8 pixel values with shape (n_pixels, 3).
+    starts, lengths : np.array
+        Start and length of each run of pixels to send.
+    """
+    bodies = [[]]
+    size = _HEADER.size
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        while length:
+            room = min((MAX_PACKET_SIZE - size - _RUN.size) // 3, 255)
+            if room <= 0:
+                bodies.append([])
+                size = _HEADER.size
+                continue
+            n = min(length, room)
+            bodies[-1].append(_RUN.pack(start, n))
+            bodies[-1].append(rgb[start:start + n].tobytes())
+            size += _RUN.size + 3 * n
+            start += n
+            length -= n
+    return _add_headers(bodies, DELTA)
+
+
+def encode_frame(rgb):
+    """Returns FRAME packets containing every pixel"""
+    per_packet = (MAX_PACKET_SIZE - _HEADER.size - _OFFSET.size) // 3
+    bodies = [[_OFFSET.pack(offset), rgb[offset:offset + per_packet].tobytes()]
+              for offset in range(0, len(rgb), per_packet)]
+    return _add_headers(bodies, FRAME)
+
+
+def encode(p, changed):
+    """Returns the smallest set of version 2 packets that updates the strip
+
+    Parameters
+    ----------
+    p : np.array
+        Pixel values with shape (3, n_pixels).
+    changed : np.array
+        Boolean array that is True for every pixel that has changed.
+    """
+    rgb = np.ascontiguousarray(p.T, dtype=np.uint8)
+    starts, lengths = runs(changed)
+    n = len(rgb)
+    per_packet = (MAX_PACKET_SIZE - _HEADER.size - _OFFSET.size) // 3
+    frame_size = 3 * n + (_HEADER.size + _OFFSET.size) * -(-n // per_packet)
+    n_runs = np.sum(-(-lengths // 255))
+    delta_size = _HEADER.size + _RUN.size * n_runs + 3 * lengths.sum()
+    if n and frame_size <= delta_size:
+        return encode_frame(rgb)
+    return encode_delta(rgb, starts, lengths)
+
+
+def decode(packet, pixels, version=VERSION):
+    """Applies a packet to an array of pixel values
+
+    Parameters
+    ----------
+    packet : bytes
+        Packet received from the Python code.
+    pixels : np.array
+        Pixel values with shape (3, n_pixels) that are updated in place.
+    version : int
+        Protocol version of the packet.
+
+    Returns
+    -------
+    show : bool
+        True if the LED strip should be updated after this packet.
+    """
+    if version == 1:
+        m = np.frombuffer(packet, dtype=np.uint8).reshape(-1, 4)
+        pixels[:, m[:, 0]] = m[:, 1:].T
+        return True
+    packet_version, flags = _HEADER.unpack_from(packet)
+    if packet_version != version:
+        raise ValueError('Unsupported protocol version {}'.format(
+            packet_version))
+    data = np.frombuffer(packet, dtype=np.uint8)
+    if flags & ~END_OF_FRAME == FRAME:
+        offset, = _OFFSET.unpack_from(packet, _HEADER.size)
+        rgb = data[_HEADER.size + _OFFSET.size:].reshape(-1, 3)
+        pixels[:, offset:offset + len(rgb)] = rgb.T
+    else:
+        i = _HEADER.size
+        while i + _RUN.size <= len(packet):
+            offset, n = _RUN.unpack_from(packet, i)
+            i += _RUN.size
+            pixels[:, offset:offset + n] = data[i:i + 3 * n].reshape(-1, 3).T
+            i += 3 * n
+    return bool(flags & END_OF_FRAME)
@@ -0,0 +1,89 @@
+"""Python stand-in for the ESP8266 firmware
+
+Receives packets over UDP and decodes them into pixel values in the same way
+as ws2812_controller.ino, so the packet protocol can be tested and benchmarked
+without any hardware. Run this file directly to receive packets on
+config.UDP_PORT and print the number of frames received every second:
+
+    python receiver.py
+
+Then set UDP_IP in config.py to '127.0.0.1' and run visualization.py.
+"""
+from __future__ import print_function
+from __future__ import division
+import socket
+import threading
+import time
+import numpy as np
+import config
+import protocol
+
+
+class Receiver:
+    """Receives and decodes LED strip packets on a UDP socket
+
+    Parameters
+    ----------
+    n_pixels : int, optional
+        Number of pixels in the simulated LED strip.
+        Defaults to config.N_PIXELS.
+    address : (str, int) tuple, optional
+        Address to listen on. Defaults to a free port on localhost.
+    version : int, optional
+        Protocol version of the packets. Defaults to protocol.VERSION.
+    """
+    def __init__(self, n_pixels=None, address=('127.0.0.1', 0), version=None):
+        n_pixels = config.N_PIXELS if n_pixels is None else n_pixels
+        self.version = protocol.VERSION if version is None else version
+        self.pixels = np.zeros((3, n_pixels), dtype=np.uint8)
+        """Pixel values that are being received"""
+        self.shown = np.zeros((3, n_pixels), dtype=np.uint8)
+        """Pixel values that were most recently shown on the simulated strip"""
+        self.frames = 0
+        self.packets = 0
+        self.bytes = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind(address)
+        self.address = self.sock.getsockname()
+        self._shown = threading.Condition()
+
+    def handle(self, packet):
+        """Decodes a single packet"""
+        self.packets += 1
+        self.bytes += len(packet)
+        if protocol.decode(packet, self.pixels, self.version):
+            with self._shown:
+                self.shown[:] = self.pixels
+                self.frames += 1
+                self._shown.notify_all()
+
+    def serve_forever(self):
+        while True:
+            self.handle(self.sock.recv(protocol.MAX_PACKET_SIZE))
+
+    def start(self):
+        """Starts receiving packets on a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def wait(self, frames, timeout=1.0):
+        """Waits until the given number of frames have been shown"""
+        end = time.time() + timeout
+        with self._shown:
+            while self.frames < frames and time.time() < end:
+                self._shown.wait(end - time.time())
+            return self.frames >= frames
+
+
+if __name__ == '__main__':
+    receiver = Receiver(address=('0.0.0.0', config.UDP_PORT)).start()
+    print('Listening on port {}'.format(config.UDP_PORT))
+    prev_frames, prev_bytes = 0, 0
+    while True:
+        time.sleep(1.0)
+        print('FPS {} ({} bytes)'.format(receiver.frames - prev_frames,
+                                         receiver.bytes - prev_bytes))
+        prev_frames, prev_bytes = receiver.frames, receiver.bytes
@@ -0,0 +1,239 @@
+"""Records the frames sent to the LED strip and plays them back
+
+Set config.RECORDING_PATH to append every frame displayed by led.update to
+a recording. A recording can then be played back on the LED strip without
+a microphone or any audio processing, for example to replay a show or to
+compare two versions of an effect:
+
+    python recording.py show.led [--speed 2] [--loop]
+
+A recording is a 32 byte header followed by one record per frame:
+
+    header   magic b'LEDFRAME', version (uint16), format (uint16),
+             number of pixels (uint32), nominal frame rate (float64) and
+             4 reserved bytes, all little endian
+    record   time since the start of the recording in seconds (float64),
+             then the pixel values as uint8 with shape (3, pixels)
+
+Frames are stored before gamma correction, so playback applies the gamma
+and dithering settings of the player. A frame identical to the previous
+one is not stored, as the player keeps showing a frame until the time of
+the next one. The player memory-maps the file and reads each frame in
+place, so even recordings of several hours play back with little CPU and
+memory. A recording cut short by a crash plays back up to the last
+complete frame.
+"""
+from __future__ import print_function
+from __future__ import division
+import mmap
+import os
+import struct
+import time
+import numpy as np
+import config
+import timing
+
+MAGIC = b'LEDFRAME'
+"""First bytes of every recording"""
+
+VERSION = 1
+"""Version of the file format written by Recorder"""
+
+FORMAT_RGB = 0
+"""Pixel values as uint8 red, green and blue rows, before gamma correction"""
+
+_header = struct.Struct('<8sHHId4x')
+"""Layout of the header at the start of a recording"""
+
+
+def record_dtype(n_pixels):
+    """Returns the numpy dtype of one frame record"""
+    return np.dtype([('time', '<f8'), ('pixels', 'u1', (3, n_pixels))])
+
+
+class Recorder:
+    """Appends frames to a new recording
+
+    Parameters
+    ----------
+    path : str
+        File to write the recording to. An existing file is replaced.
+    n_pixels : int, optional
+        Number of pixels in each frame. Defaults to config.N_PIXELS.
+    fps : float, optional
+        Nominal frame rate stored in the header. Defaults to config.FPS.
+    """
+    def __init__(self, path, n_pixels=None, fps=None):
+        self.n_pixels = config.N_PIXELS if n_pixels is None else n_pixels
+        self.fps = config.FPS if fps is None else fps
+        self.path = path
+        self.frames = 0
+        """Number of frames stored"""
+        self._file = open(path, 'wb')
+        self._file.write(_header.pack(MAGIC, VERSION, FORMAT_RGB,
+                                      self.n_pixels, self.fps))
+        self._record = np.zeros(1, dtype=record_dtype(self.n_pixels))
+        self._pending = False
+        self._pending_time = 0.0
+        self._start = timing.clock()
+
+    def write(self, frame, t=None):
+        """Adds a frame to the recording
+
+        Parameters
+        ----------
+        frame : np.array
+            Pixel values as uint8 with shape (3, n_pixels).
+        t : float, optional
+            Time of the frame in seconds since the start of the recording.
+            Defaults to the time since the recorder was created.
+        """
+        t = timing.clock() - self._start if t is None else t
+        record = self._record[0]
+        if self.frames and np.array_equal(record['pixels'], frame):
+            # Only needed to mark the end of the recording
+            self._pending_time = t
+            self._pending = True
+            return
+        record['time'] = t
+        record['pixels'] = frame
+        self._file.write(self._record.data)
+        self.frames += 1
+        self._pending = False
+
+    def close(self):
+        """Writes the last frame if it was skipped and closes the file"""
+        if self._file.closed:
+            return
+        if self._pending:
+            self._record[0]['time'] = self._pending_time
+            self._file.write(self._record.data)
+            self.frames += 1
+            self._pending = False
+        self._file.close()
+
+
+class Player:
+    """Plays back a recording through the led module
+
+    Parameters
+    ----------
+    path : str
+        File the recording was written to.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(_header.size)
+        if len(header) < _header.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not an LED recording'.format(path))
+        _, version, pixel_format, self.n_pixels, self.fps = _header.unpack(
+            header)
+        if version != VERSION or pixel_format != FORMAT_RGB:
+            raise ValueError('Unsupported recording version {} format {}'
+                             .format(version, pixel_format))
+        self.path = path
+        dtype = record_dtype(self.n_pixels)
+        n_frames = (os.path.getsize(path) - _header.size) // dtype.itemsize
+        if n_frames == 0:
+            raise ValueError('{} contains no frames'.format(path))
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.frames = np.frombuffer(self._mmap, dtype=dtype, count=n_frames,
+                                    offset=_header.size)
+        """Memory-mapped records, read from the file as they are used"""
+        if hasattr(self._mmap, 'madvise'):
+            # Frames are read in order, so the OS can read ahead
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self.times = self.frames['time']
+        """Time of each frame in seconds since the start of the recording"""
+        self.pixels = self.frames['pixels']
+        """Pixel values of each frame with shape (frames, 3, n_pixels)"""
+
+    def __len__(self):
+        return len(self.frames)
+
+    def duration(self):
+        """Returns the time of the last frame in seconds"""
+        return float(self.times[-1])
+
+    def _release(self, frames):
+        """Lets the OS drop the pages of the first frames from memory
+
+        The pages are read from the file again if they are used later, so
+        a long recording never has to be held in memory all at once.
+        """
+        if not hasattr(self._mmap, 'madvise'):
+            return
+        end = _header.size + frames * self.frames.dtype.itemsize
+        end -= end % mmap.PAGESIZE
+        if end > 0:
+            self._mmap.madvise(mmap.MADV_DONTNEED, 0, end)
+
+    def play(self, speed=1.0, loop=False, update=None):
+        """Shows every frame on the LED strip at its recorded time
+
+        Parameters
+        ----------
+        speed : float or None
+            Playback speed relative to the recording. If None, frames are
+            shown as fast as the LED strip can be updated.
+        loop : bool
+            If True, playback restarts from the beginning forever.
+        update : callable, optional
+            Function that displays the pixel values it is given. Defaults
+            to setting led.pixels and calling led.update.
+
+        Returns
+        -------
+        frames : int
+            Number of frames shown.
+        """
+        if update is None:
+            # Recording the playback would replace the recording, which may
+            # be the very file being played
+            config.RECORDING_PATH = None
+            import led
+            if self.n_pixels != config.N_PIXELS:
+                raise ValueError('Recording has {} pixels but N_PIXELS is {}'
+                                 .format(self.n_pixels, config.N_PIXELS))
+
+            def update(pixels):
+                led.pixels = pixels
+                led.update()
+        # Release the frames that have been played about every 4 MB
+        release_interval = max((4 << 20) // self.frames.dtype.itemsize, 1)
+        shown = 0
+        while True:
+            start = timing.clock()
+            for i in range(len(self.frames)):
+                if speed is not None:
+                    delay = start + self.times[i] / speed - timing.clock()
+                    if delay > 0:
+                        time.sleep(delay)
+                update(self.pixels[i])
+                shown += 1
+                if i % release_interval == release_interval - 1:
+                    self._release(i)
+            self._release(len(self.frames))
+            if not loop:
+                return shown
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='recording to play back')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed, or 0 for as fast as possible')
+    parser.add_argument('--loop', action='store_true',
+                        help='restart playback when the recording ends')
+    args = parser.parse_args()
+    player = Player(args.path)
+    print('{}: {} frames of {} pixels over {:.1f} s, recorded at {:g} FPS'
+          .format(args.path, len(player), player.n_pixels, player.duration(),
+                  player.fps))
+    start = timing.clock()
+    shown = player.play(speed=args.speed or None, loop=args.loop)
+    elapsed = timing.clock() - start
+    print('Played {} frames in {:.1f} s ({:.0f} FPS)'.format(
+        shown, elapsed, shown / max(elapsed, 1e-9)))
@@ -0,0 +1,261 @@
+"""Headless audio sources that replay files or synthetic signals
+
+These sources stand in for the microphone when no sound card is available,
+such as when reproducing a performance problem or running on a build server.
+Audio is delivered in blocks of the same size as the microphone stream, as
+int16 samples, so any callback that works with ``microphone.start_stream``
+works with ``start_stream`` in this module.
+
+Run this file directly to measure the maximum sustainable frame rate of each
+visualization effect:
+
+    python replay.py [sweep|clicks|noise|path/to/audio.wav]
+"""
+from __future__ import print_function
+from __future__ import division
+import time
+import wave
+import numpy as np
+import config
+import dsp
+import microphone
+import timing
+
+
+class AudioSource:
+    """Base class for sources that produce blocks of int16 audio samples
+
+    Subclasses implement ``read``, which returns the next block of samples
+    or None once the source is exhausted.
+    """
+    def __init__(self, rate=None, frames_per_buffer=None):
+        self.rate = config.MIC_RATE if rate is None else rate
+        if frames_per_buffer is None:
+            frames_per_buffer = dsp.stft_settings()[1]
+        self.frames_per_buffer = frames_per_buffer
+
+    def read(self):
+        raise NotImplementedError()
+
+    def rewind(self):
+        """Restarts playback, returning False if this is not supported"""
+        return False
+
+    def close(self):
+        pass
+
+
+class ArraySource(AudioSource):
+    """Plays back an array of int16 samples
+
+    The array has the shape (samples,) for mono audio or (channels, samples)
+    for multi-channel audio.
+    """
+    def __init__(self, samples, **kwargs):
+        AudioSource.__init__(self, **kwargs)
+        self.samples = samples
+        self._pos = 0
+
+    def read(self):
+        start, stop = self._pos, self._pos + self.frames_per_buffer
+        if stop > self.samples.shape[-1]:
+            return None
+        self._pos = stop
+        return self.samples[..., start:stop]
+
+    def rewind(self):
+        self._pos = 0
+        return True
+
+
+class RawSource(ArraySource):
+    """Plays back a file of raw little-endian 16-bit PCM samples
+
+    Samples of multi-channel audio are interleaved, as in a WAV file. The file
+    is memory-mapped, so long recordings are not loaded into memory.
+    """
+    def __init__(self, path, channels=1, **kwargs):
+        samples = np.memmap(path, dtype='<i2', mode='r')
+        if channels > 1:
+            samples = samples[:len(samples) // channels * channels]
+            samples = samples.reshape(-1, channels).T
+        ArraySource.__init__(self, samples, **kwargs)
+
+
+class WaveSource(AudioSource):
+    """Plays back a 16-bit WAV file
+
+    The file must either be mono or have config.N_CHANNELS channels.
+    """
+    def __init__(self, path, **kwargs):
+        self._wave = wave.open(path, 'rb')
+        kwargs.setdefault('rate', self._wave.getframerate())
+        AudioSource.__init__(self, **kwargs)
+        if self._wave.getsampwidth() != 2:
+            raise ValueError('Only 16-bit WAV files are supported')
+        self.channels = self._wave.getnchannels()
+        if self.channels not in (1, config.N_CHANNELS):
+            raise ValueError('WAV file must have 1 or {} channels'.format(
+                config.N_CHANNELS))
+        if self._wave.getframerate() != self.rate:
+            raise ValueError('WAV file sample rate must be {} Hz'.format(
+                self.rate))
+
+    def read(self):
+        data = self._wave.readframes(self.frames_per_buffer)
+        if len(data) < 2 * self.channels * self.frames_per_buffer:
+            return None
+        # Deinterleave into one row of samples per channel
+        return np.frombuffer(data, dtype='<i2').reshape(-1, self.channels).T
+
+    def rewind(self):
+        self._wave.rewind()
+        return True
+
+    def close(self):
+        self._wave.close()
+
+
+def synthetic_signal(kind, duration=10.0, rate=None, amplitude=0.5, seed=0):
+    """Returns int16 samples of a synthetic test signal
+
+    Parameters
+    ----------
+    kind : str
+        'sweep' for a logarithmic sine sweep from 20 Hz to the Nyquist
+        frequency, 'clicks' for short noise bursts twice per second over a
+        quiet noise floor, or
+        'noise' for white noise.
+    duration : float
+        Length of the signal in seconds.
+    rate : int, optional
+        Sampling rate in Hz. Defaults to ``config.MIC_RATE``.
+    amplitude : float
+        Peak amplitude between 0 and 1.
+    seed : int
+        Seed for the random number generator used by 'clicks' and 'noise'.
+    """
+    rate = config.MIC_RATE if rate is None else rate
+    t = np.arange(int(duration * rate)) / float(rate)
+    rng = np.random.RandomState(seed)
+    if kind == 'sweep':
+        f0, f1 = 20.0, rate / 2.0
+        k = np.log(f1 / f0) / duration
+        y = np.sin(2.0 * np.pi * f0 * (np.exp(k * t) - 1.0) / k)
+    elif kind == 'clicks':
+        # Bursts over a quiet noise floor, so the input never goes silent
+        y = rng.uniform(-1.0, 1.0, len(t))
+        y *= np.where((t % 0.5) < 0.01, 1.0, 0.01)
+    elif kind == 'noise':
+        y = rng.uniform(-1.0, 1.0, len(t))
+    else:
+        raise ValueError('Unknown signal: {}'.format(kind))
+    return (y * amplitude * (2**15 - 1)).astype(np.int16)
+
+
+SIGNALS = ['sweep', 'clicks', 'noise']
+"""Names of the synthetic signals that open_source understands"""
+
+
+def open_source(name, **kwargs):
+    """Returns the audio source for a signal name or a file path
+
+    Names in SIGNALS create a synthetic mono signal, paths ending in .wav are
+    read as WAV files, and any other path is read as raw 16-bit PCM with
+    config.N_CHANNELS interleaved channels.
+    """
+    if name in SIGNALS:
+        rate = kwargs.get('rate', config.MIC_RATE)
+        return ArraySource(synthetic_signal(name, rate=rate), **kwargs)
+    if name.lower().endswith('.wav'):
+        return WaveSource(name, **kwargs)
+    kwargs.setdefault('channels', config.N_CHANNELS)
+    return RawSource(name, **kwargs)
+
+
+def start_stream(callback, source=None, realtime=None, loop=None, skip=None):
+    """Passes every block of samples from an audio source to the callback
+
+    Raises ValueError if the source is shorter than a single block.
+
+    Parameters
+    ----------
+    callback : callable
+        Function that is called with each block of int16 samples, with the
+        shape (samples,) for mono sources or (channels, samples).
+    source : AudioSource, optional
+        Source to play back. Defaults to ``config.AUDIO_REPLAY_SOURCE``.
+    realtime : bool, optional
+        If True, blocks are delivered at the rate they would arrive from a
+        microphone. If False, blocks are delivered as fast as the callback
+        can process them. Defaults to ``config.AUDIO_REPLAY_REALTIME``.
+    loop : bool, optional
+        If True, playback restarts from the beginning when the source is
+        exhausted. Defaults to ``config.AUDIO_REPLAY_LOOP``.
+    skip : callable, optional
+        Function that is called with the blocks that are not rendered, as
+        in ``microphone.start_stream``. Only used when realtime is True.
+
+    Returns
+    -------
+    blocks : int
+        Number of blocks passed to the callback.
+    """
+    if source is None:
+        source = open_source(config.AUDIO_REPLAY_SOURCE)
+    realtime = config.AUDIO_REPLAY_REALTIME if realtime is None else realtime
+    loop = config.AUDIO_REPLAY_LOOP if loop is None else loop
+    period = source.frames_per_buffer / float(source.rate)
+    blocks = 0
+    # Blocks read since playback last started from the beginning
+    played = 0
+    if realtime and skip is not None:
+        microphone.scheduler = microphone.FrameScheduler()
+    start = timing.clock()
+    try:
+        while True:
+            y = source.read()
+            if y is None:
+                if played == 0:
+                    # Looping would never produce a block
+                    raise ValueError('Audio source has fewer than {} samples'
+                                     .format(source.frames_per_buffer))
+                if loop and source.rewind():
+                    played = 0
+                    continue
+                break
+            played += 1
+            if realtime:
+                # Wait until this block would have been recorded
+                delay = start + (blocks + 1) * period - timing.clock()
+                if delay > 0:
+                    time.sleep(delay)
+            if realtime and skip is not None:
+                # Blocks that would have been recorded since this one
+                backlog = int((timing.clock() - start) / period) - blocks - 1
+                if microphone.scheduler.should_render(backlog):
+                    callback(y)
+                else:
+                    skip(y)
+            else:
+                callback(y)
+            blocks += 1
+    finally:
+        source.close()
+    return blocks
+
+
+if __name__ == '__main__':
+    import sys
+    config.USE_GUI = False
+    config.DISPLAY_FPS = False
+    import visualization
+    name = sys.argv[1] if len(sys.argv) > 1 else 'sweep'
+    for effect in visualization.visualization_effects.values():
+        visualization.visualization_effect = effect
+        start = timing.clock()
+        blocks = start_stream(visualization.render, open_source(name),
+                              realtime=False, loop=False)
+        elapsed = timing.clock() - start
+        print('{:<20} {:>8.0f} FPS max ({} frames)'.format(
+            effect.name, blocks / elapsed, blocks))
@@ -0,0 +1,227 @@
+"""Latest frame shared between the audio loop and the GUI process
+
+The audio loop writes the most recent mel spectrum and pixel values into a
+FrameSnapshot in shared memory, and the GUI process reads them back at its
+own refresh rate. Both sides copy into preallocated arrays while holding a
+lock for a few microseconds. Intermediate frames written between two GUI
+refreshes are never drawn, so a slow GUI can not stall audio capture.
+
+Drawing with pyqtgraph runs Python code that holds the GIL, so a GUI drawing
+on a thread of the audio process delays the audio loop whenever it needs the
+GIL back. The GUI process has its own GIL, and runs at the lowest priority so
+that it only gets the CPU time that the audio loop leaves unused.
+
+Run this file directly to check, without a display, that a GUI process
+drawing every frame does not change the timing of the audio loop:
+
+    python snapshot.py
+"""
+from __future__ import print_function
+from __future__ import division
+import multiprocessing
+import os
+import time
+import numpy as np
+import config
+import timing
+
+
+LATE_TOLERANCE = 0.001
+"""Most that drawing may delay the audio loop in seconds
+
+The check fails if the 99th percentile lateness of the audio loop with the
+GUI drawing is more than this above its lateness without the GUI.
+"""
+
+
+def lower_priority():
+    """Lets the current process run only when the CPU would otherwise idle
+
+    Uses the idle scheduling policy on Linux, and the lowest priority nice
+    value on other Unix systems.
+    """
+    if hasattr(os, 'SCHED_IDLE'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+            return
+        except OSError:
+            pass
+    if hasattr(os, 'nice'):
+        os.nice(19)
+
+
+class FrameSnapshot:
+    """Most recent mel spectrum and pixel values of the visualization
+
+    The arrays live in shared memory, so a snapshot passed to a
+    multiprocessing.Process when it is started can be read by that process.
+
+    Parameters
+    ----------
+    n_bins : int
+        Number of mel filterbank bins.
+    n_pixels : int
+        Number of pixels in the LED strip.
+    """
+    def __init__(self, n_bins, n_pixels):
+        self._shared = (multiprocessing.RawArray('d', n_bins),
+                        multiprocessing.RawArray('d', 3 * n_pixels),
+                        multiprocessing.RawValue('L', 0),
+                        multiprocessing.Lock())
+        self._attach()
+
+    def _attach(self):
+        mel, pixels, self._sequence, self._lock = self._shared
+        self.mel = np.frombuffer(mel)
+        self.pixels = np.frombuffer(pixels).reshape(3, -1)
+
+    def __getstate__(self):
+        # Only the shared memory is sent to a new process
+        return self._shared
+
+    def __setstate__(self, shared):
+        self._shared = shared
+        self._attach()
+
+    @property
+    def sequence(self):
+        """Number of frames written, used by readers to detect new frames"""
+        return self._sequence.value
+
+    def write(self, mel, pixels):
+        """Replaces the snapshot with a new frame"""
+        with self._lock:
+            self.mel[:] = mel
+            self.pixels[:] = pixels
+            self._sequence.value += 1
+
+    def read(self, mel, pixels, sequence=0):
+        """Copies the snapshot into mel and pixels if it has a newer frame
+
+        Parameters
+        ----------
+        mel, pixels : np.array
+            Arrays with the same shapes as the snapshot arrays.
+        sequence : int
+            Sequence number returned by the previous call to read.
+
+        Returns
+        -------
+        sequence : int or None
+            Sequence number of the frame that was copied, or None if no frame
+            has been written since ``sequence``.
+        """
+        with self._lock:
+            if self._sequence.value == sequence:
+                return None
+            mel[:] = self.mel
+            pixels[:] = self.pixels
+            return self._sequence.value
+
+
+def _audio_loop(snapshot, render, blocks, frame_period):
+    """Renders a frame for every block at frame_period intervals
+
+    Returns how late each frame started and how long it took to render and
+    write to the snapshot, in seconds.
+    """
+    mel = np.zeros(len(snapshot.mel))
+    late = np.zeros(len(blocks))
+    durations = np.zeros(len(blocks))
+    start_time = timing.clock()
+    for i, block in enumerate(blocks):
+        scheduled = start_time + i * frame_period
+        time.sleep(max(scheduled - timing.clock(), 0.0))
+        start = timing.clock()
+        late[i] = start - scheduled
+        snapshot.write(mel, render(block))
+        durations[i] = timing.clock() - start
+    return late, durations
+
+
+def _draw(seconds):
+    """Busy Python loop standing in for pyqtgraph drawing a frame"""
+    end = timing.clock() + seconds
+    total = 0
+    while timing.clock() < end:
+        for i in range(1000):
+            total += i * i
+    return total
+
+
+def _gui(snapshot, done, drawn, draw_time, refresh_period):
+    """Stand-in for the GUI process that draws every new frame"""
+    lower_priority()
+    mel = np.zeros_like(snapshot.mel)
+    pixels = np.zeros_like(snapshot.pixels)
+    sequence = 0
+    while not done.is_set():
+        new = snapshot.read(mel, pixels, sequence)
+        if new is not None:
+            sequence = new
+            drawn.value += 1
+            _draw(draw_time)
+        time.sleep(refresh_period)
+
+
+def check(n_frames=300, draw_time=0.02):
+    """Compares the audio loop with and without a slow GUI process
+
+    The audio loop renders frames with visualization.render at config.FPS.
+    A GUI process polls the snapshot at config.GUI_FPS and keeps the CPU busy
+    for ``draw_time`` seconds for each frame it draws, to simulate pyqtgraph
+    drawing on a slow machine.
+
+    Returns
+    -------
+    results : dict
+        The 99th percentile lateness and render time of the audio loop in
+        ms without and with the GUI, and the number of frames the GUI drew.
+    """
+    config.USE_GUI = False
+    config.DISPLAY_FPS = False
+    import replay
+    import visualization
+    block = visualization.samples_per_frame
+    audio = replay.synthetic_signal('noise', duration=(n_frames + 1) * block /
+                                    float(config.MIC_RATE))
+    blocks = [audio[i * block:(i + 1) * block] for i in range(n_frames)]
+    snapshot = FrameSnapshot(config.N_FFT_BINS, config.N_PIXELS)
+    frame_period = 1.0 / config.FPS
+    render = visualization.render
+    baseline = _audio_loop(snapshot, render, blocks, frame_period)
+    done = multiprocessing.Event()
+    drawn = multiprocessing.Value('i', 0)
+    gui = multiprocessing.Process(target=_gui, args=(
+        snapshot, done, drawn, draw_time, 1.0 / config.GUI_FPS))
+    gui.daemon = True
+    gui.start()
+    loaded = _audio_loop(snapshot, render, blocks, frame_period)
+    done.set()
+    gui.join()
+    results = {'frame_period_ms': 1e3 * frame_period,
+               'frames_written': n_frames,
+               'frames_drawn': drawn.value}
+    for name, (late, durations) in (('baseline', baseline),
+                                    ('gui', loaded)):
+        results[name + '_late_p99_ms'] = 1e3 * np.percentile(late, 99)
+        results[name + '_render_p99_ms'] = 1e3 * np.percentile(durations, 99)
+    return results
+
+
+if __name__ == '__main__':
+    results = check()
+    for name, label in (('baseline', 'without GUI'), ('gui', 'with GUI')):
+        print('Audio loop {:<11} p99 late {:5.2f} ms, p99 render {:5.2f} ms'
+              .format(label, results[name + '_late_p99_ms'],
+                      results[name + '_render_p99_ms']))
+    print('GUI drew {} of {} frames'.format(results['frames_drawn'],
+                                            results['frames_written']))
+    # Drawing must not delay the audio loop by more than LATE_TOLERANCE,
+    # and every frame must still finish on time
+    ok = (results['gui_late_p99_ms'] <=
+          results['baseline_late_p99_ms'] + 1e3 * LATE_TOLERANCE and
+          results['gui_late_p99_ms'] + results['gui_render_p99_ms'] <
+          results['frame_period_ms'])
+    print('PASS' if ok else 'FAIL')
+    raise SystemExit(0 if ok else 1)
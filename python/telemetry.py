@@ -0,0 +1,168 @@
+"""Local HTTP endpoint that publishes live metrics as JSON
+
+Intended for headless installations, where the only other runtime signal is
+the FPS printed to stdout. Set config.TELEMETRY_PORT to enable the endpoint,
+then read the metrics with any HTTP client:
+
+    curl http://localhost:8080/
+
+The response contains the frame rate, the time since the last frame, audio
+overflows, skipped and late frames, packets and bytes sent to the LED strip,
+the current effect and the frequency range. Per-stage latencies and event
+counters from the timing module are included when config.INSTRUMENTATION is
+True.
+
+The audio loop records each frame in a Collector without taking any locks,
+and the endpoint reads whatever values are current from its own thread.
+Run this file directly to check the endpoint on localhost:
+
+    python telemetry.py
+"""
+from __future__ import print_function
+from __future__ import division
+import json
+import threading
+import time
+import numpy as np
+import config
+import led
+import microphone
+import timing
+
+
+class Collector:
+    """Frame times and state of the audio loop
+
+    The audio loop is the only writer, and each frame only stores a time
+    and increments a counter, so no lock is needed. A reader on another
+    thread may see a frame that is partly recorded, which at most shifts
+    the frame rate estimate by one frame.
+
+    Parameters
+    ----------
+    history : int
+        Number of recent frame times used to estimate the frame rate.
+    """
+    def __init__(self, history=64):
+        self._times = np.zeros(history)
+        self.frames = 0
+        """Total number of frames recorded"""
+        self.effect = None
+        """Name of the effect used for the most recent frame"""
+
+    def frame(self, effect=None):
+        """Records that a frame was rendered with the named effect"""
+        self._times[self.frames % len(self._times)] = timing.clock()
+        self.frames += 1
+        self.effect = effect
+
+    def fps(self):
+        """Returns the frame rate over the recent frame history"""
+        n = min(self.frames, len(self._times))
+        times = self._times[:n].copy()
+        if n < 2 or times.max() == times.min():
+            return 0.0
+        return (n - 1) / (times.max() - times.min())
+
+    def seconds_since_frame(self):
+        """Returns the time since the most recent frame, or None"""
+        if self.frames == 0:
+            return None
+        return timing.clock() - self._times.max()
+
+
+collector = Collector()
+"""Collector updated by the audio loop for every rendered frame"""
+
+
+def collect():
+    """Returns the current metrics as a dictionary"""
+    data = {
+        'time': time.time(),
+        'frames': collector.frames,
+        'fps': collector.fps(),
+        'target_fps': config.FPS,
+        'seconds_since_frame': collector.seconds_since_frame(),
+        'effect': collector.effect,
+        'frequency_range': [config.MIN_FREQUENCY, config.MAX_FREQUENCY],
+        'audio_overflows': microphone.overflows,
+        'skipped_frames': getattr(microphone.scheduler, 'skipped', 0),
+        'late_frames': getattr(microphone.scheduler, 'late', 0),
+        'led': {'device': config.DEVICE,
+                'packets': led.packets_sent,
+                'bytes': led.bytes_sent},
+    }
+    if timing.enabled:
+        data.update(timing.snapshot())
+    return data
+
+
+def start(port=None, host=None):
+    """Serves the metrics on a background thread and returns the server
+
+    Parameters
+    ----------
+    port : int, optional
+        Port to listen on. Defaults to config.TELEMETRY_PORT. Use 0 for any
+        free port, which is given by ``server.server_address``.
+    host : str, optional
+        Address to listen on. Defaults to config.TELEMETRY_HOST.
+    """
+    # The HTTP server is imported here because it is slow to import
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = json.dumps(collect()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Requests are not logged, to keep stdout for the FPS display
+            pass
+
+    port = config.TELEMETRY_PORT if port is None else port
+    host = config.TELEMETRY_HOST if host is None else host
+    server = HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    try:
+        from urllib.request import urlopen
+    except ImportError:
+        from urllib2 import urlopen
+    # Cost of recording a frame, which is paid by the audio loop
+    n = 100000
+    start_time = timing.clock()
+    for i in range(n):
+        collector.frame('spectrum')
+    print('Collector overhead: {:.2f} us per frame'.format(
+        1e6 * (timing.clock() - start_time) / n))
+    # Simulate a second of frames and read the metrics from the endpoint
+    collector = Collector()
+    server = start(port=0, host='127.0.0.1')
+    url = 'http://{}:{}/'.format(*server.server_address)
+    for i in range(config.FPS):
+        collector.frame('spectrum')
+        time.sleep(1.0 / config.FPS)
+    data = json.loads(urlopen(url).read().decode('utf-8'))
+    print(json.dumps(data, indent=2, sort_keys=True))
+    ok = (data['frames'] == config.FPS and
+          0.5 * config.FPS < data['fps'] < 1.5 * config.FPS and
+          data['effect'] == 'spectrum')
+    server.shutdown()
+    print('PASS' if ok else 'FAIL')
+    raise SystemExit(0 if ok else 1)
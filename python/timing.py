@@ -0,0 +1,184 @@
+"""Lightweight per-stage timing instrumentation
+
+Stages of the audio and LED pipeline are timed with a monotonic clock and
+recorded in fixed-bucket histograms, from which the median and 99th percentile
+duration of each stage is estimated. Event counters track dropped frames and
+audio overflows. A summary is printed, or appended as JSON to a file, every
+config.INSTRUMENTATION_INTERVAL seconds.
+
+Usage:
+
+    t = timing.start()
+    do_work()
+    timing.stop('work', t)
+
+When config.INSTRUMENTATION is False, start and stop return immediately.
+"""
+from __future__ import print_function
+from __future__ import division
+import bisect
+import json
+import time
+import config
+
+clock = getattr(time, 'perf_counter', time.time)
+"""Highest resolution monotonic clock available, used by every module"""
+
+enabled = config.INSTRUMENTATION
+"""Whether timings and counters are being recorded"""
+
+startup_time = time.time()
+"""Time at which this module was first imported, where startup begins"""
+
+_startup_stages = []
+
+
+class Histogram:
+    """Histogram of durations with logarithmically spaced buckets
+
+    Bucket edges are spaced four per octave from 1 us to about 1 s, so any
+    percentile is accurate to within 19%. Durations outside this range are
+    counted in the first or last bucket.
+    """
+    edges = [1e-6 * 2.0**(i / 4.0) for i in range(81)]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.edges) + 1)
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect(self.edges, seconds)] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Returns the upper edge of the bucket containing percentile q"""
+        if self.total == 0:
+            return 0.0
+        rank = q / 100.0 * self.total
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                upper = self.edges[i] if i < len(self.edges) else self.max
+                return min(upper, self.max)
+        return self.max
+
+
+histograms = {}
+"""Histogram of durations for each stage, keyed by stage name"""
+
+counters = {'frames': 0, 'dropped_frames': 0, 'skipped_frames': 0,
+            'late_frames': 0, 'audio_overflows': 0}
+"""Event counts since the last summary"""
+
+_prev_report = None
+
+
+def start():
+    """Returns the start time of a stage"""
+    return clock() if enabled else 0.0
+
+
+def stop(stage, start_time):
+    """Records the duration of a stage that began at start_time"""
+    if enabled:
+        record(stage, clock() - start_time)
+
+
+def record(stage, seconds):
+    """Records the duration of a stage that was measured by the caller"""
+    if not enabled:
+        return
+    try:
+        histograms[stage].record(seconds)
+    except KeyError:
+        histograms[stage] = Histogram()
+        histograms[stage].record(seconds)
+
+
+def count(name, n=1):
+    """Adds n to the named event counter"""
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+def snapshot():
+    """Returns the p50/p99 duration of each stage in ms and the counters"""
+    stages = {}
+    # Copy the items first, as another thread may add a stage meanwhile
+    for stage, hist in list(histograms.items()):
+        stages[stage] = {'p50_ms': 1000.0 * hist.percentile(50),
+                         'p99_ms': 1000.0 * hist.percentile(99),
+                         'max_ms': 1000.0 * hist.max,
+                         'count': hist.total}
+    return {'stages': stages, 'counters': dict(counters)}
+
+
+def summary(elapsed):
+    """Returns a one line summary of the stage timings and counters"""
+    text = ['FPS {:.0f} / {:.0f}'.format(counters['frames'] / elapsed,
+                                         config.FPS)]
+    for stage in sorted(histograms):
+        hist = histograms[stage]
+        text.append('{} {:.2f}/{:.2f} ms'.format(
+            stage, 1000.0 * hist.percentile(50), 1000.0 * hist.percentile(99)))
+    text.append('dropped {} skipped {} late {} overflows {}'.format(
+        counters['dropped_frames'], counters['skipped_frames'],
+        counters['late_frames'], counters['audio_overflows']))
+    return ' | '.join(text)
+
+
+def reset():
+    """Clears all histograms and counters"""
+    for hist in histograms.values():
+        hist.reset()
+    for name in counters:
+        counters[name] = 0
+
+
+def mark(stage):
+    """Records the time since startup at which a startup stage finished"""
+    _startup_stages.append((stage, time.time() - startup_time))
+
+
+def startup_summary():
+    """Returns a one line summary of the time taken to reach each stage"""
+    return 'Startup: ' + ' | '.join(
+        '{} {:.0f} ms'.format(stage, 1000.0 * seconds)
+        for stage, seconds in _startup_stages)
+
+
+def report():
+    """Counts a frame and outputs a summary if the interval has elapsed
+
+    This function is intended to be called one time for every iteration of
+    the program's main loop.
+    """
+    global _prev_report
+    if not enabled:
+        return
+    now = clock()
+    if _prev_report is None:
+        # Start the first interval at the first frame rather than at import
+        _prev_report = now
+        return
+    counters['frames'] += 1
+    elapsed = now - _prev_report
+    if elapsed < config.INSTRUMENTATION_INTERVAL:
+        return
+    _prev_report = now
+    if config.INSTRUMENTATION_PATH is None:
+        print(summary(elapsed))
+    else:
+        data = snapshot()
+        data['time'] = time.time()
+        data['fps'] = counters['frames'] / elapsed
+        with open(config.INSTRUMENTATION_PATH, 'a') as f:
+            f.write(json.dumps(data) + '\n')
+    reset()
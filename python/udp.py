@@ -0,0 +1,103 @@
+"""Sends batches of UDP packets with as few system calls as possible
+
+On Linux all packets are handed to the kernel with a single sendmmsg(2) call.
+Other platforms fall back to calling sendto once for every packet.
+"""
+from __future__ import print_function
+from __future__ import division
+import ctypes
+import ctypes.util
+import os
+import socket
+import struct
+import sys
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                         ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+"""libc sendmmsg function, or None if it is not available"""
+
+_sockaddrs = {}
+"""Cache of packed sockaddr_in structures for each (ip, port) address"""
+
+
+def _sockaddr(address):
+    if address not in _sockaddrs:
+        ip, port = address
+        _sockaddrs[address] = ctypes.create_string_buffer(
+            struct.pack('=H', socket.AF_INET) + struct.pack('>H', port) +
+            socket.inet_aton(socket.gethostbyname(ip)) + b'\0' * 8)
+    return _sockaddrs[address]
+
+
+def send_batch(sock, messages):
+    """Sends a list of (packet, address) tuples on a UDP socket
+
+    Parameters
+    ----------
+    sock : socket.socket
+        IPv4 UDP socket used to send the packets.
+    messages : list of (bytes, (str, int)) tuples
+        Packets to send, each paired with the (ip, port) to send it to.
+    """
+    if _sendmmsg is None or sock.family != socket.AF_INET:
+        for packet, address in messages:
+            sock.sendto(packet, address)
+        return
+    n = len(messages)
+    headers = (_mmsghdr * n)()
+    vectors = (_iovec * n)()
+    # Keep references to the packet buffers until the call returns
+    buffers = []
+    for i, (packet, address) in enumerate(messages):
+        buf = ctypes.c_char_p(packet)
+        buffers.append(buf)
+        vectors[i].iov_base = ctypes.cast(buf, ctypes.c_void_p)
+        vectors[i].iov_len = len(packet)
+        name = _sockaddr(address)
+        headers[i].msg_hdr.msg_name = ctypes.addressof(name)
+        headers[i].msg_hdr.msg_namelen = ctypes.sizeof(name) - 1
+        headers[i].msg_hdr.msg_iov = ctypes.pointer(vectors[i])
+        headers[i].msg_hdr.msg_iovlen = 1
+    sent = 0
+    fd = sock.fileno()
+    while sent < n:
+        vec = ctypes.addressof(headers) + sent * ctypes.sizeof(_mmsghdr)
+        count = _sendmmsg(fd, vec, n - sent, 0)
+        if count < 0:
+            errno = ctypes.get_errno()
+            raise socket.error(errno, os.strerror(errno))
+        sent += count
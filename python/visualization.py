@@ -1,12 +1,20 @@
 from __future__ import print_function
 from __future__ import division
+import collections
 import time
+# Imported first so that the startup report includes the other imports
+import timing
 import numpy as np
-from scipy.ndimage.filters import gaussian_filter1d
 import config
 import microphone
 import dsp
+import effects
 import led
+import snapshot
+import zones
+if config.TELEMETRY_PORT is not None:
+    import telemetry
+timing.mark('imports')
 
 _time_prev = time.time() * 1000.0
 """The previous time that the frames_per_second() function was called"""
@@ -41,316 +49,255 @@ def frames_per_second():
     return _fps.update(1000.0 / dt)
 
 
-def memoize(function):
-    """Provides a decorator for memoizing functions"""
-    from functools import wraps
-    memo = {}
-
-    @wraps(function)
-    def wrapper(*args):
-        if args in memo:
-            return memo[args]
-        else:
-            rv = function(*args)
-            memo[args] = rv
-            return rv
-    return wrapper
-
-
-@memoize
-def _normalized_linspace(size):
-    return np.linspace(0, 1, size)
-
-
-def interpolate(y, new_length):
-    """Intelligently resizes the array by linearly interpolating the values
-
-    Parameters
-    ----------
-    y : np.array
-        Array that should be resized
-
-    new_length : int
-        The length of the new interpolated array
-
-    Returns
-    -------
-    z : np.array
-        New array with length of new_length that contains the interpolated
-        values of y.
-    """
-    if len(y) == new_length:
-        return y
-    x_old = _normalized_linspace(len(y))
-    x_new = _normalized_linspace(new_length)
-    z = np.interp(x_new, x_old, y)
-    return z
-
-
-r_filt = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.2, alpha_rise=0.99)
-g_filt = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.05, alpha_rise=0.3)
-b_filt = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.1, alpha_rise=0.5)
-common_mode = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.99, alpha_rise=0.01)
-p_filt = dsp.ExpFilter(np.tile(1, (3, config.N_PIXELS // 2)),
-                       alpha_decay=0.1, alpha_rise=0.99)
-p = np.tile(1.0, (3, config.N_PIXELS // 2))
-gain = dsp.ExpFilter(np.tile(0.01, config.N_FFT_BINS),
-                     alpha_decay=0.001, alpha_rise=0.99)
-
-
-def visualize_scroll(y):
-    """Effect that originates in the center and scrolls outwards"""
-    global p
-    y = y**2.0
-    gain.update(y)
-    y /= gain.value
-    y *= 255.0
-    r = int(np.max(y[:len(y) // 3]))
-    g = int(np.max(y[len(y) // 3: 2 * len(y) // 3]))
-    b = int(np.max(y[2 * len(y) // 3:]))
-    # Scrolling effect window
-    p[:, 1:] = p[:, :-1]
-    p *= 0.98
-    p = gaussian_filter1d(p, sigma=0.2)
-    # Create new color originating at the center
-    p[0, 0] = r
-    p[1, 0] = g
-    p[2, 0] = b
-    # Update the LED strip
-    return np.concatenate((p[:, ::-1], p), axis=1)
-
-
-def visualize_energy(y):
-    """Effect that expands from the center with increasing sound energy"""
-    global p
-    y = np.copy(y)
-    gain.update(y)
-    y /= gain.value
-    # Scale by the width of the LED strip
-    y *= float((config.N_PIXELS // 2) - 1)
-    # Map color channels according to energy in the different freq bands
-    scale = 0.9
-    r = int(np.mean(y[:len(y) // 3]**scale))
-    g = int(np.mean(y[len(y) // 3: 2 * len(y) // 3]**scale))
-    b = int(np.mean(y[2 * len(y) // 3:]**scale))
-    # Assign color to different frequency regions
-    p[0, :r] = 255.0
-    p[0, r:] = 0.0
-    p[1, :g] = 255.0
-    p[1, g:] = 0.0
-    p[2, :b] = 255.0
-    p[2, b:] = 0.0
-    p_filt.update(p)
-    p = np.round(p_filt.value)
-    # Apply substantial blur to smooth the edges
-    p[0, :] = gaussian_filter1d(p[0, :], sigma=4.0)
-    p[1, :] = gaussian_filter1d(p[1, :], sigma=4.0)
-    p[2, :] = gaussian_filter1d(p[2, :], sigma=4.0)
-    # Set the new pixel value
-    return np.concatenate((p[:, ::-1], p), axis=1)
-
-
-_prev_spectrum = np.tile(0.01, config.N_PIXELS // 2)
-
-
-def visualize_spectrum(y):
-    """Effect that maps the Mel filterbank frequencies onto the LED strip"""
-    global _prev_spectrum
-    y = np.copy(interpolate(y, config.N_PIXELS // 2))
-    common_mode.update(y)
-    diff = y - _prev_spectrum
-    _prev_spectrum = np.copy(y)
-    # Color channel mappings
-    r = r_filt.update(y - common_mode.value)
-    g = np.abs(diff)
-    b = b_filt.update(np.copy(y))
-    # Mirror the color channels for symmetric output
-    r = np.concatenate((r[::-1], r))
-    g = np.concatenate((g[::-1], g))
-    b = np.concatenate((b[::-1], b))
-    output = np.array([r, g,b]) * 255
-    return output
-
-
-fft_plot_filter = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
-                         alpha_decay=0.5, alpha_rise=0.99)
 mel_gain = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
                          alpha_decay=0.01, alpha_rise=0.99)
-mel_smoothing = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
+mel_smoothing = dsp.ExpFilter(np.tile(1e-1, (config.N_CHANNELS, config.N_FFT_BINS)),
                          alpha_decay=0.5, alpha_rise=0.99)
 volume = dsp.ExpFilter(config.MIN_VOLUME_THRESHOLD,
                        alpha_decay=0.02, alpha_rise=0.02)
-fft_window = np.hamming(int(config.MIC_RATE / config.FPS) * config.N_ROLLING_HISTORY)
 prev_fps_update = time.time()
 
 
 def microphone_update(audio_samples):
-    global y_roll, prev_rms, prev_exp, prev_fps_update
-    # Normalize samples between 0 and 1
-    y = audio_samples / 2.0**15
-    # Construct a rolling window of audio samples
-    y_roll[:-1] = y_roll[1:]
-    y_roll[-1, :] = np.copy(y)
-    y_data = np.concatenate(y_roll, axis=0).astype(np.float32)
-    
-    vol = np.max(np.abs(y_data))
+    """Renders a block of audio samples and displays it on the LED strip"""
+    display(render(audio_samples))
+
+
+def analyze(audio_samples):
+    """Returns the normalized mel spectrum after adding new audio samples
+
+    The samples are added to the rolling audio window, which is transformed
+    into a gain normalized and smoothed mel spectrum. Returns None when the
+    volume of the window is below config.MIN_VOLUME_THRESHOLD.
+
+    All audio channels are analyzed together. The mel spectrum of each
+    channel is stored in mel_channels, and the mean of the channels is
+    returned.
+    """
+    global mel_channels
+    t = timing.start()
+    # Add the new samples to the rolling window of audio samples
+    stft.push(audio_samples)
+    y_data = stft.latest()
+    vol = max(y_data.max(), -y_data.min())
+    timing.stop('window', t)
+    if _detect_onsets() and onsets.subdivisions > 1:
+        # Detect onsets in short hops over the newest samples
+        t = timing.start()
+        onsets.push(audio_samples)
+        timing.stop('onset', t)
     if vol < config.MIN_VOLUME_THRESHOLD:
         print('No audio input. Volume below threshold. Volume:', vol)
-        led.pixels = np.tile(0, (3, config.N_PIXELS))
-        led.update()
+        return None
+    # Transform audio input into the frequency domain
+    t = timing.start()
+    YS = stft.spectrum()
+    timing.stop('fft', t)
+    # Construct a Mel filterbank from the FFT data
+    t = timing.start()
+    mel = dsp.current_mel_bank().apply(YS, out=_mel)
+    # Scale data to values more suitable for visualization
+    np.square(mel, out=mel)
+    timing.stop('mel', t)
+    # Gain normalization
+    t = timing.start()
+    mel_gain.update(np.max(dsp.gaussian_blur(mel, sigma=1.0)))
+    mel /= mel_gain.value
+    mel_channels = mel_smoothing.update(mel)
+    timing.stop('gain', t)
+    if _detect_onsets() and onsets.subdivisions == 1:
+        # Detect onsets from the unsmoothed spectrum of the frame
+        t = timing.start()
+        onsets.update(mel)
+        timing.stop('onset', t)
+    if config.N_CHANNELS == 1:
+        return mel_channels[0]
+    return np.mean(mel_channels, axis=0, out=_mel_mean)
+
+
+def _detect_onsets():
+    """Returns whether onsets are detected for the current effect"""
+    return onsets is not None and visualization_effect.uses_onsets
+
+
+def skip_frame(audio_samples):
+    """Adds a block of audio samples to the analysis without rendering it"""
+    stft.push(audio_samples)
+    if _detect_onsets() and onsets.subdivisions > 1:
+        # An onset in this block is shown by the next rendered frame
+        onsets.push(audio_samples, keep=True)
+
+
+def set_frequency_range(min_frequency, max_frequency):
+    """Changes the frequency range of the mel filterbank in Hz"""
+    global zone_map, visualization_effect
+    config.MIN_FREQUENCY = min_frequency
+    config.MAX_FREQUENCY = max_frequency
+    dsp.create_mel_bank()
+    if zone_map is not None:
+        # The zone frequency ranges now cover different mel bands
+        try:
+            new_zone_map = zones.from_config(onsets)
+        except ValueError as e:
+            print(e)
+        else:
+            if visualization_effect is zone_map:
+                visualization_effect = new_zone_map
+            zone_map = new_zone_map
+
+
+def _apply_gui_controls():
+    """Applies the settings selected in the GUI window since the last frame"""
+    global _gui_sequence, visualization_effect
+    if gui_controls.closed:
+        # Closing the window stops the visualization
+        raise SystemExit
+    settings = gui_controls.read(_gui_sequence)
+    if settings is None:
+        return
+    _gui_sequence, effect, min_frequency, max_frequency = settings
+    if effect is not None:
+        visualization_effect = visualization_effects[effect]
+    if (min_frequency != config.MIN_FREQUENCY or
+            max_frequency != config.MAX_FREQUENCY):
+        set_frequency_range(min_frequency, max_frequency)
+
+
+def render(audio_samples):
+    """Returns the LED strip pixel values for a new block of audio samples"""
+    global prev_fps_update
+    global _frame_index
+    if gui_controls is not None:
+        _apply_gui_controls()
+    mel = analyze(audio_samples)
+    # Render into the next frame buffer, as the previous frames may still
+    # be waiting to be displayed by the pipeline
+    _frame_index = (_frame_index + 1) % len(_frames)
+    output = _frames[_frame_index]
+    if mel is None:
+        output.fill(0)
     else:
-        # Transform audio input into the frequency domain
-        N = len(y_data)
-        N_zeros = 2**int(np.ceil(np.log2(N))) - N
-        # Pad with zeros until the next power of two
-        y_data *= fft_window
-        y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
-        YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
-        # Construct a Mel filterbank from the FFT data
-        mel = np.atleast_2d(YS).T * dsp.mel_y.T
-        # Scale data to values more suitable for visualization
-        # mel = np.sum(mel, axis=0)
-        mel = np.sum(mel, axis=0)
-        mel = mel**2.0
-        # Gain normalization
-        mel_gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
-        mel /= mel_gain.value
-        mel = mel_smoothing.update(mel)
         # Map filterbank output onto LED strip
-        output = visualization_effect(mel)
-        led.pixels = output
-        led.update()
+        t = timing.start()
+        if visualization_effect is zone_map:
+            # Zones may react to a single audio channel
+            zone_map.render(mel, output, mel_channels)
+        else:
+            visualization_effect.render(mel, output)
+        timing.stop('effect', t)
         if config.USE_GUI:
-            # Plot filterbank output
-            x = np.linspace(config.MIN_FREQUENCY, config.MAX_FREQUENCY, len(mel))
-            mel_curve.setData(x=x, y=fft_plot_filter.update(mel))
-            # Plot the color channels
-            r_curve.setData(y=led.pixels[0])
-            g_curve.setData(y=led.pixels[1])
-            b_curve.setData(y=led.pixels[2])
-    if config.USE_GUI:
-        app.processEvents()
-    
-    if config.DISPLAY_FPS:
+            # The GUI process draws the latest frame at its own rate
+            gui_snapshot.write(mel, output)
+    if config.TELEMETRY_PORT is not None:
+        telemetry.collector.frame(visualization_effect.name)
+    if config.INSTRUMENTATION:
+        timing.report()
+    elif config.DISPLAY_FPS and not config.USE_PIPELINE:
+        # The pipeline prints the FPS in its own summary
         fps = frames_per_second()
         if time.time() - 0.5 > prev_fps_update:
             prev_fps_update = time.time()
             print('FPS {:.0f} / {:.0f}'.format(fps, config.FPS))
+    return output
+
+
+def display(output):
+    """Displays rendered pixel values on the LED strip"""
+    global _first_frame
+    led.pixels = output
+    led.update()
+    if _first_frame:
+        _first_frame = False
+        timing.mark('first frame')
+        print(timing.startup_summary())
+
+
+_first_frame = True
+"""Whether the first frame has yet to be displayed"""
+
+
+# Short-time Fourier transform of the rolling window of audio samples
+stft = dsp.STFT(*dsp.stft_settings(), channels=config.N_CHANNELS)
+
+mel_channels = np.tile(1e-1, (config.N_CHANNELS, config.N_FFT_BINS))
+"""Most recent mel spectrum of each audio channel"""
 
+_mel = np.zeros((config.N_CHANNELS, config.N_FFT_BINS))
+"""Unsmoothed mel spectrum of each channel, reused by every frame"""
+
+_mel_mean = np.zeros(config.N_FFT_BINS)
+"""Mean mel spectrum of the channels, reused by every frame"""
 
 # Number of audio samples to read every time frame
-samples_per_frame = int(config.MIC_RATE / config.FPS)
+samples_per_frame = stft.hop_length
+
+onsets = None
+"""Onset detector the effects react to, or None if ONSET_DETECTION is False
+
+Onsets are only detected while the visualization effect reacts to them.
+"""
+if config.ONSET_DETECTION:
+    onsets = dsp.OnsetDetector(config.N_FFT_BINS, samples_per_frame,
+                               config.ONSET_SUBDIVISIONS,
+                               threshold=config.ONSET_THRESHOLD,
+                               channels=config.N_CHANNELS)
 
-# Array containing the rolling audio sample window
-y_roll = np.random.rand(config.N_ROLLING_HISTORY, samples_per_frame) / 1e16
+visualization_effects = collections.OrderedDict(
+    (name, effect(onsets=onsets)) for name, effect in effects.EFFECTS.items())
+"""Instance of every effect, each keeping its own state"""
 
-visualization_effect = visualize_spectrum
+zone_map = zones.from_config(onsets)
+"""Effects shown on each zone of the strip, or None if ZONES is not set"""
+
+visualization_effect = visualization_effects['spectrum']
 """Visualization effect to display on the LED strip"""
+if zone_map is not None:
+    visualization_effect = zone_map
+
+_frames = [np.zeros((3, config.N_PIXELS))
+           for _ in range(config.PIPELINE_QUEUE_SIZE + 2)]
+"""Frame buffers rendered into in turn
+
+One frame may be rendered and another displayed while PIPELINE_QUEUE_SIZE
+frames are queued between them, so a buffer is not reused until every
+frame rendered after it has been displayed or discarded.
+"""
+_frame_index = 0
+
+gui_snapshot = snapshot.FrameSnapshot(config.N_FFT_BINS, config.N_PIXELS)
+"""Most recent frame, read by the GUI process at config.GUI_FPS"""
+
+gui_controls = None
+"""Settings selected in the GUI window, or None if the GUI is not shown"""
+_gui_sequence = 0
 
 
 if __name__ == '__main__':
     if config.USE_GUI:
-        import pyqtgraph as pg
-        from pyqtgraph.Qt import QtGui, QtCore
-        # Create GUI window
-        app = QtGui.QApplication([])
-        view = pg.GraphicsView()
-        layout = pg.GraphicsLayout(border=(100,100,100))
-        view.setCentralItem(layout)
-        view.show()
-        view.setWindowTitle('Visualization')
-        view.resize(800,600)
-        # Mel filterbank plot
-        fft_plot = layout.addPlot(title='Filterbank Output', colspan=3)
-        fft_plot.setRange(yRange=[-0.1, 1.2])
-        fft_plot.disableAutoRange(axis=pg.ViewBox.YAxis)
-        x_data = np.array(range(1, config.N_FFT_BINS + 1))
-        mel_curve = pg.PlotCurveItem()
-        mel_curve.setData(x=x_data, y=x_data*0)
-        fft_plot.addItem(mel_curve)
-        # Visualization plot
-        layout.nextRow()
-        led_plot = layout.addPlot(title='Visualization Output', colspan=3)
-        led_plot.setRange(yRange=[-5, 260])
-        led_plot.disableAutoRange(axis=pg.ViewBox.YAxis)
-        # Pen for each of the color channel curves
-        r_pen = pg.mkPen((255, 30, 30, 200), width=4)
-        g_pen = pg.mkPen((30, 255, 30, 200), width=4)
-        b_pen = pg.mkPen((30, 30, 255, 200), width=4)
-        # Color channel curves
-        r_curve = pg.PlotCurveItem(pen=r_pen)
-        g_curve = pg.PlotCurveItem(pen=g_pen)
-        b_curve = pg.PlotCurveItem(pen=b_pen)
-        # Define x data
-        x_data = np.array(range(1, config.N_PIXELS + 1))
-        r_curve.setData(x=x_data, y=x_data*0)
-        g_curve.setData(x=x_data, y=x_data*0)
-        b_curve.setData(x=x_data, y=x_data*0)
-        # Add curves to plot
-        led_plot.addItem(r_curve)
-        led_plot.addItem(g_curve)
-        led_plot.addItem(b_curve)
-        # Frequency range label
-        freq_label = pg.LabelItem('')
-        # Frequency slider
-        def freq_slider_change(tick):
-            minf = freq_slider.tickValue(0)**2.0 * (config.MIC_RATE / 2.0)
-            maxf = freq_slider.tickValue(1)**2.0 * (config.MIC_RATE / 2.0)
-            t = 'Frequency range: {:.0f} - {:.0f} Hz'.format(minf, maxf)
-            freq_label.setText(t)
-            config.MIN_FREQUENCY = minf
-            config.MAX_FREQUENCY = maxf
-            dsp.create_mel_bank()
-        freq_slider = pg.TickSliderItem(orientation='bottom', allowAdd=False)
-        freq_slider.tickMoveFinished = freq_slider_change
-        freq_slider.addTick((config.MIN_FREQUENCY / (config.MIC_RATE / 2.0))**0.5)
-        freq_slider.addTick((config.MAX_FREQUENCY / (config.MIC_RATE / 2.0))**0.5)
-        freq_label.setText('Frequency range: {} - {} Hz'.format(
-            config.MIN_FREQUENCY,
-            config.MAX_FREQUENCY))
-        # Effect selection
-        active_color = '#16dbeb'
-        inactive_color = '#FFFFFF'
-        def energy_click(x):
-            global visualization_effect
-            visualization_effect = visualize_energy
-            energy_label.setText('Energy', color=active_color)
-            scroll_label.setText('Scroll', color=inactive_color)
-            spectrum_label.setText('Spectrum', color=inactive_color)
-        def scroll_click(x):
-            global visualization_effect
-            visualization_effect = visualize_scroll
-            energy_label.setText('Energy', color=inactive_color)
-            scroll_label.setText('Scroll', color=active_color)
-            spectrum_label.setText('Spectrum', color=inactive_color)
-        def spectrum_click(x):
-            global visualization_effect
-            visualization_effect = visualize_spectrum
-            energy_label.setText('Energy', color=inactive_color)
-            scroll_label.setText('Scroll', color=inactive_color)
-            spectrum_label.setText('Spectrum', color=active_color)
-        # Create effect "buttons" (labels with click event)
-        energy_label = pg.LabelItem('Energy')
-        scroll_label = pg.LabelItem('Scroll')
-        spectrum_label = pg.LabelItem('Spectrum')
-        energy_label.mousePressEvent = energy_click
-        scroll_label.mousePressEvent = scroll_click
-        spectrum_label.mousePressEvent = spectrum_click
-        energy_click(0)
-        # Layout
-        layout.nextRow()
-        layout.addItem(freq_label, colspan=3)
-        layout.nextRow()
-        layout.addItem(freq_slider, colspan=3)
-        layout.nextRow()
-        layout.addItem(energy_label)
-        layout.addItem(scroll_label)
-        layout.addItem(spectrum_label)
+        # The GUI is drawn by its own process from gui_snapshot
+        import window
+        gui_controls = window.Controls(visualization_effects)
+        window.start(gui_snapshot, gui_controls, zones=zone_map is not None)
     # Initialize LEDs
     led.update()
-    # Start listening to live audio stream
-    microphone.start_stream(microphone_update)
+    if config.TELEMETRY_PORT is not None:
+        telemetry.start()
+    timing.mark('setup')
+    # Start listening to live audio stream or replaying recorded audio
+    if config.AUDIO_REPLAY_SOURCE is None:
+        start_stream = microphone.start_stream
+    else:
+        import replay
+        start_stream = replay.start_stream
+    if config.USE_PIPELINE:
+        import pipeline
+        if config.AUDIO_REPLAY_SOURCE is None or config.AUDIO_REPLAY_REALTIME:
+            # Replayed audio that is not paced in real time is rendered as
+            # fast as possible, as it is without the pipeline
+            microphone.scheduler = microphone.FrameScheduler()
+        run = pipeline.Pipeline(start_stream, render, display,
+                                skip=skip_frame,
+                                scheduler=microphone.scheduler).run
+    else:
+        run = lambda: start_stream(microphone_update, skip=skip_frame)
+    run()
@@ -0,0 +1,234 @@
+"""Visualization GUI window, drawn by its own process
+
+The window plots the mel spectrum and the pixel values that the audio loop
+writes to a snapshot.FrameSnapshot, at up to config.GUI_FPS. It runs on a
+separate process at the lowest priority, so drawing never holds the GIL or
+the CPU while the audio loop needs them.
+
+The effect and the frequency range selected in the window are sent back to
+the audio process through a Controls object, which the audio loop reads
+once per frame.
+"""
+from __future__ import print_function
+from __future__ import division
+import multiprocessing
+import numpy as np
+import config
+import dsp
+import snapshot
+
+
+class Controls:
+    """Settings selected in the GUI window, shared with the audio process
+
+    Parameters
+    ----------
+    effects : iterable of str
+        Names of the effects that can be selected.
+    """
+    def __init__(self, effects):
+        self.effects = list(effects)
+        self._effect = multiprocessing.RawValue('i', -1)
+        self._frequency_range = multiprocessing.RawArray(
+            'd', [config.MIN_FREQUENCY, config.MAX_FREQUENCY])
+        self._closed = multiprocessing.RawValue('b', 0)
+        self._sequence = multiprocessing.RawValue('L', 0)
+        self._lock = multiprocessing.Lock()
+
+    def select_effect(self, name):
+        """Selects the effect shown on the LED strip"""
+        with self._lock:
+            self._effect.value = self.effects.index(name)
+            self._sequence.value += 1
+
+    def select_frequency_range(self, min_frequency, max_frequency):
+        """Selects the frequency range of the mel filterbank in Hz"""
+        with self._lock:
+            self._frequency_range[:] = [min_frequency, max_frequency]
+            self._sequence.value += 1
+
+    def close(self):
+        """Tells the audio process that the window has been closed"""
+        self._closed.value = 1
+
+    @property
+    def closed(self):
+        """Whether the window has been closed"""
+        return bool(self._closed.value)
+
+    def read(self, sequence=0):
+        """Returns the selected settings if they have changed
+
+        Parameters
+        ----------
+        sequence : int
+            Sequence number returned by the previous call to read.
+
+        Returns
+        -------
+        settings : tuple or None
+            Tuple of the sequence number, the name of the selected effect or
+            None if no effect has been selected, and the minimum and maximum
+            frequency. None if nothing has changed since ``sequence``.
+        """
+        if self._sequence.value == sequence:
+            return None
+        with self._lock:
+            effect = self._effect.value
+            return (self._sequence.value,
+                    self.effects[effect] if effect >= 0 else None,
+                    self._frequency_range[0], self._frequency_range[1])
+
+
+def start(frames, controls, zones=False):
+    """Opens the GUI window on a new process
+
+    Parameters
+    ----------
+    frames : snapshot.FrameSnapshot
+        Snapshot that the audio loop writes every frame to.
+    controls : Controls
+        Settings that the window selects.
+    zones : bool
+        Whether config.ZONES is set. If False, the energy effect is selected
+        when the window opens, otherwise the zones are shown until an effect
+        is selected.
+
+    Returns
+    -------
+    process : multiprocessing.Process
+        The process drawing the window. It exits when the window is closed.
+    """
+    # A process started any other way imports the main module again, which
+    # for visualization.py would open the LED strip a second time
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if fork else None)
+    process = context.Process(target=_run, args=(frames, controls, zones))
+    process.daemon = True
+    process.start()
+    return process
+
+
+def _run(frames, controls, zones):
+    """Draws the window until it is closed"""
+    import pyqtgraph as pg
+    from pyqtgraph.Qt import QtGui, QtCore
+    # Only draw when the audio loop leaves the CPU idle
+    snapshot.lower_priority()
+    fft_plot_filter = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
+                                    alpha_decay=0.5, alpha_rise=0.99)
+    # Create GUI window
+    app = QtGui.QApplication([])
+    view = pg.GraphicsView()
+    layout = pg.GraphicsLayout(border=(100,100,100))
+    view.setCentralItem(layout)
+    view.show()
+    view.setWindowTitle('Visualization')
+    view.resize(800,600)
+    # Mel filterbank plot
+    fft_plot = layout.addPlot(title='Filterbank Output', colspan=3)
+    fft_plot.setRange(yRange=[-0.1, 1.2])
+    fft_plot.disableAutoRange(axis=pg.ViewBox.YAxis)
+    x_data = np.array(range(1, config.N_FFT_BINS + 1))
+    mel_curve = pg.PlotCurveItem()
+    mel_curve.setData(x=x_data, y=x_data*0)
+    fft_plot.addItem(mel_curve)
+    # Visualization plot
+    layout.nextRow()
+    led_plot = layout.addPlot(title='Visualization Output', colspan=3)
+    led_plot.setRange(yRange=[-5, 260])
+    led_plot.disableAutoRange(axis=pg.ViewBox.YAxis)
+    # Pen for each of the color channel curves
+    r_pen = pg.mkPen((255, 30, 30, 200), width=4)
+    g_pen = pg.mkPen((30, 255, 30, 200), width=4)
+    b_pen = pg.mkPen((30, 30, 255, 200), width=4)
+    # Color channel curves
+    r_curve = pg.PlotCurveItem(pen=r_pen)
+    g_curve = pg.PlotCurveItem(pen=g_pen)
+    b_curve = pg.PlotCurveItem(pen=b_pen)
+    # Define x data
+    x_data = np.array(range(1, config.N_PIXELS + 1))
+    r_curve.setData(x=x_data, y=x_data*0)
+    g_curve.setData(x=x_data, y=x_data*0)
+    b_curve.setData(x=x_data, y=x_data*0)
+    # Add curves to plot
+    led_plot.addItem(r_curve)
+    led_plot.addItem(g_curve)
+    led_plot.addItem(b_curve)
+    # Frequency range label
+    freq_label = pg.LabelItem('')
+    # Frequency slider
+    def freq_slider_change(tick):
+        minf = freq_slider.tickValue(0)**2.0 * (config.MIC_RATE / 2.0)
+        maxf = freq_slider.tickValue(1)**2.0 * (config.MIC_RATE / 2.0)
+        t = 'Frequency range: {:.0f} - {:.0f} Hz'.format(minf, maxf)
+        freq_label.setText(t)
+        # The range is also used to label the filterbank plot
+        config.MIN_FREQUENCY = minf
+        config.MAX_FREQUENCY = maxf
+        controls.select_frequency_range(minf, maxf)
+    freq_slider = pg.TickSliderItem(orientation='bottom', allowAdd=False)
+    freq_slider.tickMoveFinished = freq_slider_change
+    freq_slider.addTick((config.MIN_FREQUENCY / (config.MIC_RATE / 2.0))**0.5)
+    freq_slider.addTick((config.MAX_FREQUENCY / (config.MIC_RATE / 2.0))**0.5)
+    freq_label.setText('Frequency range: {} - {} Hz'.format(
+        config.MIN_FREQUENCY,
+        config.MAX_FREQUENCY))
+    # Effect selection
+    active_color = '#16dbeb'
+    inactive_color = '#FFFFFF'
+    def energy_click(x):
+        controls.select_effect('energy')
+        energy_label.setText('Energy', color=active_color)
+        scroll_label.setText('Scroll', color=inactive_color)
+        spectrum_label.setText('Spectrum', color=inactive_color)
+    def scroll_click(x):
+        controls.select_effect('scroll')
+        energy_label.setText('Energy', color=inactive_color)
+        scroll_label.setText('Scroll', color=active_color)
+        spectrum_label.setText('Spectrum', color=inactive_color)
+    def spectrum_click(x):
+        controls.select_effect('spectrum')
+        energy_label.setText('Energy', color=inactive_color)
+        scroll_label.setText('Scroll', color=inactive_color)
+        spectrum_label.setText('Spectrum', color=active_color)
+    # Create effect "buttons" (labels with click event)
+    energy_label = pg.LabelItem('Energy')
+    scroll_label = pg.LabelItem('Scroll')
+    spectrum_label = pg.LabelItem('Spectrum')
+    energy_label.mousePressEvent = energy_click
+    scroll_label.mousePressEvent = scroll_click
+    spectrum_label.mousePressEvent = spectrum_click
+    if not zones:
+        energy_click(0)
+    # Layout
+    layout.nextRow()
+    layout.addItem(freq_label, colspan=3)
+    layout.nextRow()
+    layout.addItem(freq_slider, colspan=3)
+    layout.nextRow()
+    layout.addItem(energy_label)
+    layout.addItem(scroll_label)
+    layout.addItem(spectrum_label)
+    # Redraw the plots with the latest frame at a capped refresh rate
+    gui_mel = np.zeros(config.N_FFT_BINS)
+    gui_pixels = np.zeros((3, config.N_PIXELS))
+    gui_sequence = [0]
+    def update_gui():
+        sequence = frames.read(gui_mel, gui_pixels, gui_sequence[0])
+        if sequence is None:
+            return
+        gui_sequence[0] = sequence
+        # Plot filterbank output
+        x = np.linspace(config.MIN_FREQUENCY, config.MAX_FREQUENCY,
+                        len(gui_mel))
+        mel_curve.setData(x=x, y=fft_plot_filter.update(gui_mel))
+        # Plot the color channels
+        r_curve.setData(y=gui_pixels[0])
+        g_curve.setData(y=gui_pixels[1])
+        b_curve.setData(y=gui_pixels[2])
+    gui_timer = QtCore.QTimer()
+    gui_timer.timeout.connect(update_gui)
+    gui_timer.start(int(1000 / config.GUI_FPS))
+    app.exec_()
+    controls.close()
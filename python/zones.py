@@ -0,0 +1,185 @@
+"""Renders different effects on different segments of the LED strip
+
+A strip that is physically split into zones, such as a bar, a stage and a
+ceiling, can show a different effect in each zone, each reacting to its own
+frequency range. The audio is analyzed once per frame. Each zone then
+renders from a slice of the shared mel spectrum directly into its segment
+of the shared frame, so a zone only adds the cost of its effect.
+
+Zones are configured with config.ZONES, for example:
+
+    ZONES = [
+        {'pixels': slice(0, 100), 'effect': 'spectrum'},
+        {'pixels': slice(100, 160), 'effect': 'energy',
+         'max_frequency': 800},
+        {'pixels': slice(160, 300), 'effect': 'scroll',
+         'min_frequency': 1000},
+    ]
+
+With N_CHANNELS = 2, a zone can react to a single audio channel, so that
+each half of a strip follows the left or the right channel:
+
+    ZONES = [
+        {'pixels': slice(0, 30), 'effect': 'scroll', 'channel': 0},
+        {'pixels': slice(30, 60), 'effect': 'scroll', 'channel': 1},
+    ]
+"""
+from __future__ import print_function
+from __future__ import division
+import numpy as np
+import config
+import effects
+import melbank
+
+
+def band_range(freq_min, freq_max, n_bins=None, bank_min=None, bank_max=None):
+    """Returns the slice of mel bands with center frequencies in a range
+
+    Parameters
+    ----------
+    freq_min, freq_max : float
+        Frequency range in Hz.
+    n_bins : int, optional
+        Number of mel bands. Defaults to config.N_FFT_BINS.
+    bank_min, bank_max : float, optional
+        Frequency range of the whole mel filterbank in Hz. Defaults to
+        config.MIN_FREQUENCY and config.MAX_FREQUENCY.
+    """
+    n_bins = config.N_FFT_BINS if n_bins is None else n_bins
+    bank_min = config.MIN_FREQUENCY if bank_min is None else bank_min
+    bank_max = config.MAX_FREQUENCY if bank_max is None else bank_max
+    centers, _, _ = melbank.melfrequencies_mel_filterbank(
+        n_bins, bank_min, bank_max, None)
+    centers = melbank.mel_to_hertz(centers)
+    bands = np.flatnonzero((centers >= freq_min) & (centers <= freq_max))
+    if len(bands) == 0:
+        return slice(0, 0)
+    return slice(int(bands[0]), int(bands[-1]) + 1)
+
+
+class Zone:
+    """Segment of the strip that shows one effect
+
+    Parameters
+    ----------
+    pixels : slice
+        Pixels of the frame covered by the zone. A reversed slice, such as
+        ``slice(99, None, -1)``, renders the effect back to front.
+    effect : str
+        Name of the effect in effects.EFFECTS.
+    min_frequency, max_frequency : float, optional
+        Frequency range the effect reacts to, in Hz. Only mel bands with a
+        center frequency in this range are used. Defaults to the whole
+        range of the filterbank.
+    channel : int, optional
+        Audio channel the effect reacts to, from 0 to N_CHANNELS - 1.
+        Defaults to the mean of all of the channels.
+    n_pixels, n_bins : int, optional
+        Number of pixels in the frame and mel bands in the spectrum.
+        Default to config.N_PIXELS and config.N_FFT_BINS.
+    n_channels : int, optional
+        Number of audio channels. Defaults to config.N_CHANNELS.
+    onsets : dsp.OnsetDetector, optional
+        Onset detector the effect may react to.
+    """
+    def __init__(self, pixels, effect, min_frequency=None, max_frequency=None,
+                 channel=None, n_pixels=None, n_bins=None, n_channels=None,
+                 onsets=None):
+        n_pixels = config.N_PIXELS if n_pixels is None else n_pixels
+        n_bins = config.N_FFT_BINS if n_bins is None else n_bins
+        n_channels = config.N_CHANNELS if n_channels is None else n_channels
+        if not isinstance(pixels, slice):
+            raise ValueError('Zone pixels must be a slice, got {!r}'.format(
+                pixels))
+        self.pixels = pixels
+        self.indices = np.arange(n_pixels)[pixels]
+        """Index of every pixel in the zone"""
+        if min_frequency is None:
+            min_frequency = config.MIN_FREQUENCY
+        if max_frequency is None:
+            max_frequency = config.MAX_FREQUENCY
+        self.frequency_range = (min_frequency, max_frequency)
+        self.bands = band_range(min_frequency, max_frequency, n_bins)
+        """Slice of the mel spectrum that the effect renders from"""
+        n_bands = self.bands.stop - self.bands.start
+        if n_bands < 3:
+            # The effects split the bands into red, green and blue thirds
+            raise ValueError('Zone {!r} covers {} mel bands between {} and '
+                             '{} Hz, at least 3 are needed'.format(
+                                 pixels, n_bands, min_frequency,
+                                 max_frequency))
+        if channel is not None and not 0 <= channel < n_channels:
+            raise ValueError('Zone {!r} uses audio channel {}, but there are '
+                             '{} channels'.format(pixels, channel, n_channels))
+        self.channel = channel
+        """Audio channel the effect reacts to, or None for all of them"""
+        self.effect = effects.create(effect, len(self.indices), n_bands,
+                                     onsets)
+
+    def render(self, mel, frame, mel_channels=None):
+        """Renders the zone into its segment of the frame
+
+        Parameters
+        ----------
+        mel : np.array
+            Mel spectrum of all of the audio channels.
+        frame : np.array
+            Frame with shape (3, n_pixels) to render into.
+        mel_channels : np.array, optional
+            Mel spectrum of each audio channel, with shape (channels, bands).
+            If None, the zone renders from mel even if it has a channel.
+        """
+        if self.channel is not None and mel_channels is not None:
+            mel = mel_channels[self.channel]
+        return self.effect.render(mel[..., self.bands], frame[:, self.pixels])
+
+
+class ZoneMap:
+    """Effect that renders every zone of the strip into one frame
+
+    Has the same render method as the effects, so it can be used as the
+    visualization effect. Pixels that are not in any zone are off, and
+    where zones overlap the last zone is shown.
+
+    Parameters
+    ----------
+    zones : list of dict
+        Keyword arguments of each Zone, as in config.ZONES.
+    n_pixels, n_bins : int, optional
+        Number of pixels in the frame and mel bands in the spectrum.
+        Default to config.N_PIXELS and config.N_FFT_BINS.
+    onsets : dsp.OnsetDetector, optional
+        Onset detector shared by the effects of every zone.
+    """
+    name = 'zones'
+
+    def __init__(self, zones, n_pixels=None, n_bins=None, onsets=None):
+        n_pixels = config.N_PIXELS if n_pixels is None else n_pixels
+        self.zones = [Zone(n_pixels=n_pixels, n_bins=n_bins, onsets=onsets,
+                           **zone)
+                      for zone in zones]
+        self.uses_onsets = any(zone.effect.uses_onsets for zone in self.zones)
+        """Whether the effect of any zone reacts to onsets"""
+        covered = np.zeros(n_pixels, dtype=bool)
+        for zone in self.zones:
+            covered[zone.indices] = True
+        self._uncovered = np.flatnonzero(~covered)
+
+    def render(self, mel, out, mel_channels=None):
+        """Renders every zone into out
+
+        Zones with an audio channel render from its row of mel_channels,
+        the mel spectrum of each channel. The other zones render from mel.
+        """
+        if len(self._uncovered):
+            out[:, self._uncovered] = 0.0
+        for zone in self.zones:
+            zone.render(mel, out, mel_channels)
+        return out
+
+
+def from_config(onsets=None):
+    """Returns the ZoneMap of config.ZONES, or None if ZONES is None"""
+    if config.ZONES is None:
+        return None
+    return ZoneMap(config.ZONES, onsets=onsets)